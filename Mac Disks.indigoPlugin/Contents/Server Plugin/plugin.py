@@ -4,15 +4,45 @@
 # http://www.indigodomo.com
 
 import indigo
+import os
 import time
+import array
+import BaseHTTPServer
+import bisect
+import collections
+import cProfile
+import ctypes
+import ctypes.util
+import errno
+import hashlib
+import heapq
+import itertools
+import json
+import marshal
+import plistlib
+import random
 import re
+import select
+import signal
+import socket
+import SocketServer
+import stat
 import subprocess
+import threading
+import Queue
 import urlparse
 from urllib import pathname2url
 try:
     from shlex import quote as cmd_quote
 except ImportError:
     from pipes import quote as cmd_quote
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
 
 # Note the "indigo" module is automatically imported and made available inside
 # our global name space by the host process.
@@ -28,22 +58,129 @@ k_networkMountCmd   = "/bin/mkdir {mountpoint} 2>/dev/null; /sbin/mount -t {urls
 k_networkOpenCmd    = "open -g {volumeurl}".format
 k_networkUnmountCmd = "/sbin/umount {force} {identifier}".format
 
-k_dfGetDataCmd      = "/bin/df -mn"
-k_dfInfoGroupsKeys  =           (       'size',   'used',   'free',  'percent'    )
-k_dfInfoGroupsRegex = re.compile(r".+? ([0-9]+) +([0-9]+) +([0-9]+) +([0-9]+)% .+")
-k_dfSearchExp       = "^{identifier} .*$".format
-k_dfSearchNull      = "^$"
+# df and mount in one fork; both outputs are parsed in a single pass over the lines
+k_dfGetDataCmd      = "/bin/df -mni && /sbin/mount"
+k_dfInfoGroupsKeys  =           (   'identifier', 'size',   'used',   'free',  'percent',     'iused',   'ifree', 'ipercent',   'mountpoint' )
+k_dfInfoGroupsRegex = re.compile(r"(.+?) +([0-9]+) +([0-9]+) +([0-9]+) +([0-9]+)% +(?:([0-9]+) +([0-9]+) +([0-9]+)% +)?(/.*)")
+k_dfInfoIntKeys     = ('size', 'used', 'free', 'percent', 'iused', 'ifree', 'ipercent')
+k_mountGroupsKeys   =           ( 'identifier', 'mountpoint',       'fstype', 'options' )
+k_mountGroupsRegex  = re.compile(r"(.+?) on (/.*?)(?: type ([^ ]+))? \(([^()]*)\)$")
+k_readOnlyOptions   = ('read-only', 'ro', 'rdonly')
+k_statvfsReadOnly   = 1     # ST_RDONLY
+k_darwinNoWait      = 2     # MNT_NOWAIT
 
-k_duGetDataCmd      = "/usr/sbin/diskutil list"
-k_duSearchExp       = "^.* {volumename}  .*$".format
+k_bytesPerMeg       = 1024*1024
+
+k_duGetDataCmd      = "/usr/sbin/diskutil list -plist"
 k_duInfoGroupsKeys  =           (       '#',       'type',      'name',       'size',          'identifier'  )
 k_duInfoGroupsRegex = re.compile(r" *([0-9]+): +([a-zA-Z0-9_]*) (.*?) *[+* ]([0-9.,]+ [A-Z]+) *([a-z0-9]+) *")
+k_duContainerTypes  = ('Apple_CoreStorage', 'Apple_APFS')
+k_duApfsVolumeType  = 'APFS'
+
+k_statvfsTimeout    = 2.0   # seconds a single mount point may take before it is treated as hung
 
-k_touchDiskCmd      = "/usr/bin/touch {mountpoint}/.preventsleep".format
+k_touchFileName     = ".preventsleep"
+k_touchTimeout      = 10    # seconds
 
 k_returnFalseCmd    = "echo {message}; false".format
 
+k_commandTimeout    = 30    # seconds
+k_executorWorkers   = 4
+k_executorStopWait  = 2     # seconds
+
+k_mountPollFirst    = 0.02  # seconds, first mount point check after a command
+k_mountPollMax      = 1.0   # seconds, longest gap between checks
+k_mountWaitLocal    = 10    # seconds to wait for a local volume to appear or disappear
+k_mountWaitNetwork  = 60    # seconds to wait for a network volume
+
+k_periodicTasks     = set(('poll', 'identify', 'touch'))
+k_bulkActions       = {'bulkMount':True, 'bulkUnmount':False, 'bulkToggle':None}
+
+k_schedulerTick     = 1.0   # seconds, longest uninterrupted sleep
+k_startupCoalesce   = 2.0   # seconds, window for batching the first poll
+k_touchJitter       = 0.1   # fraction of touch interval
+
+k_statsSamples      = 100   # cycles kept per phase
+k_statsPhases       = ('cycle', 'statvfs', 'df', 'diskutil', 'parse', 'update', 'server', 'mount', 'touch')
+k_statusPhases      = ('cycle', 'statvfs', 'df', 'diskutil', 'update', 'server', 'mount')
+k_statusFreq        = 60    # seconds between status device updates
+k_profileFileName   = "profile-{0}.prof".format
+
+k_volumesDir        = "/Volumes"
+k_mountInfoFile     = "/proc/self/mountinfo"
+
 k_urlSchemes        = {'smb':'smbfs', 'nfs':'nfs', 'afp':'afp', 'ftp':'ftp', 'webdav':'webdav'}
+k_schemePorts       = {'smb':(445,), 'nfs':(2049,), 'afp':(548,), 'ftp':(21,), 'webdav':(80,443)}
+
+k_probeTimeout      = 1.0   # seconds per connect attempt
+k_probeCacheSecs    = 15    # seconds a reachability result is shared between devices
+k_resolveTimeout    = 1.0   # seconds to wait for a host name lookup
+k_resolveCacheSecs  = 300   # seconds a resolved address is reused
+
+k_remountFirst      = 30    # seconds before the first automatic remount attempt
+k_remountMax        = 1800  # seconds, longest backoff between attempts
+k_remountJitter     = 0.2   # fraction of backoff
+
+k_stateFormatters   = { 'percent_free'  : '{0}%'.format,
+                        'percent_used'  : '{0}%'.format,
+                        'megs_free'     : '{0} MB'.format,
+                        'megs_used'     : '{0} MB'.format,
+                        'megs_total'    : '{0} MB'.format,
+                        'touch_latency_ms' : '{0} ms'.format,
+                        'percent_inodes_used' : '{0}%'.format,
+                        'fill_rate_mb_per_hour' : '{0} MB/h'.format,
+                        'hours_to_full' : lambda hours: '{0} h'.format(hours) if hours >= 0 else 'never',
+                        }
+k_sizeStrings       = { 'size_total'    : 'megs_total',
+                        'size_used'     : 'megs_used',
+                        'size_free'     : 'megs_free',
+                        }
+k_deadbandMegKeys   = ('megs_total', 'megs_used', 'megs_free')
+k_deadbandPctKeys   = ('percent_used', 'percent_free')
+k_capacityKeys      = k_deadbandMegKeys + k_deadbandPctKeys + tuple(k_sizeStrings) + ('fill_rate_mb_per_hour', 'hours_to_full',
+                                                                                       'inodes_free', 'percent_inodes_used')
+
+k_historyFineSecs   = 86400 # seconds of samples kept at poll resolution
+k_historyFineMax    = 8640  # samples, caps memory for very short poll intervals
+k_historyHourSecs   = 3600
+k_historyHours      = 720   # hourly averages, 30 days
+k_historyMinSamples = 3
+k_historyMinSpan    = 600   # seconds of samples before a fill rate is reported
+k_historyVersion    = 1
+k_historyFileName   = "history-{0}.bin".format
+
+k_scanWorkers       = 2
+k_scanRate          = 2000  # directory entries per second, keeps a scan from saturating the disk
+k_scanBatch         = 200   # entries between throttle checks
+k_scanCacheMaxAge   = 86400 # seconds before cached directory totals are rebuilt from scratch
+k_scanTopCount      = 10
+k_scanFileName      = "scan-{0}.json".format
+
+k_metricsHost       = '127.0.0.1'
+k_metricsPort       = 9345
+k_prometheusType    = 'text/plain; version=0.0.4; charset=utf-8'
+k_jsonType          = 'application/json'
+# prometheus name: (state key, help)
+k_metricStates      = ( ('mounted',                      'onOffState',            "Whether the volume is mounted."),
+                        ('size_megabytes',               'megs_total',            "Volume size in MB."),
+                        ('used_megabytes',               'megs_used',             "Space used in MB."),
+                        ('free_megabytes',               'megs_free',             "Space available in MB."),
+                        ('used_percent',                 'percent_used',          "Percentage of space used."),
+                        ('inodes_free',                  'inodes_free',           "Free inodes."),
+                        ('inodes_used_percent',          'percent_inodes_used',   "Percentage of inodes used."),
+                        ('read_only',                    'read_only',             "Whether the volume is mounted read-only."),
+                        ('fill_rate_megabytes_per_hour', 'fill_rate_mb_per_hour', "Rate at which used space is growing."),
+                        ('hours_to_full',                'hours_to_full',         "Projected hours until full, -1 if not filling."),
+                        ('touch_latency_milliseconds',   'touch_latency_ms',      "Duration of the last prevent-sleep touch."),
+                        )
+
+# event type: (state key, fires when rising, fixed threshold)
+k_triggerTypes      = { 'freeSpaceBelow'    : ('{units}_free',          False,  None),
+                        'usageAbove'        : ('{units}_used',          True,   None),
+                        'fillRateAbove'     : ('fill_rate_mb_per_hour', True,   None),
+                        'volumeMounted'     : ('onOffState',            True,   0),
+                        'volumeUnmounted'   : ('onOffState',            False,  1),
+                        }
 
 ################################################################################
 class Plugin(indigo.PluginBase):
@@ -64,22 +201,58 @@ class Plugin(indigo.PluginBase):
         self.identifyFreq   = int(self.pluginPrefs.get('identifyFreq','10'))*60
         self.touchDiskFreq  = int(self.pluginPrefs.get('touchDiskFreq','10'))*60
         self.mountMethod    = self.pluginPrefs.get('networkMountMethod','mount')
+        self.capacityMethod = self.pluginPrefs.get('capacityMethod','statvfs')
         self.debug          = self.pluginPrefs.get('showDebugInfo',False)
         self.logger.debug("startup")
         if self.debug:
             self.logger.debug("Debug logging enabled")
 
         self.deviceDict = dict()
-
-        self._dfData = ""
+        self.statusDict = dict()
+        self.stats      = PhaseStats()
+        self.executor   = CommandExecutor(self.logger)
+        self.scanPool   = CommandExecutor(self.logger, workers=k_scanWorkers)
+        self.probe      = ReachabilityProbe()
+        self.statvfsProbe = StatvfsProbe()
+        self.scheduler  = DeviceScheduler()
+        self.triggers   = TriggerIndex()
+        self.dataLock   = threading.RLock()
+
+        self.mountWatcher       = MountTableWatcher()
+        self.mountGeneration    = 0
+        self.identifierCache    = IdentifierCache(self.pluginPrefs.get('identifierCache',''))
+
+        self.startupDue         = time.time() + k_startupCoalesce
+
+        self._profileRequest    = 0
+        self._profiler          = None
+        self._profileCycles     = 0
+        self._lastStatusUpdate  = 0
+
+        self._dfData = DfSnapshot()
         self._dfRefresh = True
-        self._duData = ""
+        self._duData = DuSnapshot()
         self._duRefresh = True
+        self._svData = StatvfsSnapshot()
+        self._svPending = set()
+        self._mtData = MountTable()
+        self._mtRefresh = True
+
+        self.metrics = None
+        self.startMetrics(self.pluginPrefs.get('metricsEnabled',False), int(self.pluginPrefs.get('metricsPort',k_metricsPort)))
 
     #-------------------------------------------------------------------------------
     def shutdown(self):
         self.logger.debug("shutdown")
+        self.startMetrics(False)
+        for diskDev in self.deviceDict.values():
+            diskDev.cancelScan()
+        self.scanPool.stop()
+        self.executor.stop()
         self.pluginPrefs["showDebugInfo"] = self.debug
+        self.pluginPrefs["identifierCache"] = self.identifierCache.dumps()
+        for diskDev in self.deviceDict.values():
+            diskDev.saveHistory()
 
     #-------------------------------------------------------------------------------
     def closedPrefsConfigUi(self, valuesDict, userCancelled):
@@ -88,13 +261,17 @@ class Plugin(indigo.PluginBase):
             self.stateLoopFreq  = int(valuesDict['stateLoopFreq'])
             self.identifyFreq   = int(valuesDict['identifyFreq'])*60
             self.touchDiskFreq  = int(valuesDict['touchDiskFreq'])*60
+            self.capacityMethod = valuesDict['capacityMethod']
 
             if valuesDict['networkMountMethod'] != self.mountMethod:
                 self.mountMethod = valuesDict['networkMountMethod']
                 for devId,intance in self.deviceDict.items():
                     if intance.dev.deviceTypeId == 'networkDisk':
+                        intance.saveHistory()
                         self.deviceDict[devId] = NetworkDiskDevice(intance.dev, self)
 
+            self.startMetrics(valuesDict['metricsEnabled'], int(valuesDict['metricsPort']))
+
             self.debug = valuesDict['showDebugInfo']
             if self.debug:
                 self.logger.debug("Debug logging enabled")
@@ -104,6 +281,12 @@ class Plugin(indigo.PluginBase):
         self.logger.debug("validatePrefsConfigUi")
         errorsDict = indigo.Dict()
 
+        try:
+            if not 1024 <= int(valuesDict.get('metricsPort','0')) <= 65535:
+                errorsDict['metricsPort'] = "Must be between 1024 and 65535"
+        except ValueError:
+            errorsDict['metricsPort'] = "Must be a whole number"
+
         if len(errorsDict) > 0:
             self.logger.debug('validate prefs config error: \n{0}'.format(str(errorsDict)))
             return (False, valuesDict, errorsDict)
@@ -111,25 +294,83 @@ class Plugin(indigo.PluginBase):
 
     #-------------------------------------------------------------------------------
     def runConcurrentThread(self):
-        lastIdentify = lastTouchDisk = 0
-        self.sleep(self.stateLoopFreq)
         try:
             while True:
-                loopStart = time.time()
+                self.runDueTasks(time.time())
+                self.sleepUntilDue()
+        except self.StopThread:
+            pass    # Optionally catch the StopThread exception and do any needed cleanup.
+        finally:
+            if self._profiler:
+                self._profiler.disable()
+                self.saveProfile()
 
-                doIdentify  = loopStart >= lastIdentify  + self.identifyFreq
-                doTouchDisk = loopStart >= lastTouchDisk + self.touchDiskFreq
+    #-------------------------------------------------------------------------------
+    def runDueTasks(self, now):
+        # one pass of the concurrent thread; returns how many devices were due
+        dueTasks = dict()
+        for devId, task in self.scheduler.popDue(now):
+            dueTasks.setdefault(devId, set()).add(task)
+        if not dueTasks:
+            return 0
+
+        self.startProfile()
+        with self.stats.timer('cycle'):
+            self.refresh_data(any('identify' in tasks for tasks in dueTasks.values()),
+                              [self.deviceDict[devId] for devId in dueTasks if devId in self.deviceDict])
+            # snapshots are fetched lazily by the first device that needs them, so 'update'
+            # includes the statvfs, df and diskutil time that those phases also record
+            with self.stats.timer('update'):
+                for devId, tasks in dueTasks.items():
+                    diskDev = self.deviceDict.get(devId)
+                    if diskDev:
+                        diskDev.update('identify' in tasks, 'touch' in tasks)
+                        if 'remount' in tasks:
+                            diskDev.remount()
+                        if 'verify' in tasks:
+                            diskDev.verifyMount(now)
+                        for task in tasks & k_periodicTasks:
+                            self.scheduleTask(diskDev, task, now)
+        self.stopProfile()
+        self.updateStatusDevices()
+        if self.metrics:
+            self.metrics.publish(self.deviceDict.values())
+        return len(dueTasks)
 
-                self.refresh_data()
-                for devId, dev in self.deviceDict.items():
-                    dev.update(doIdentify, doTouchDisk)
+    #-------------------------------------------------------------------------------
+    def sleepUntilDue(self):
+        # sleep in short ticks so newly scheduled devices are not kept waiting
+        self.scheduler.wake.clear()
+        due = self.scheduler.nextDue()
+        while not self.scheduler.wake.is_set():
+            remaining = (due or time.time() + k_schedulerTick) - time.time()
+            if remaining <= 0:
+                break
+            self.sleep(min(remaining, k_schedulerTick))
+            if self.checkMounts():
+                # something was mounted or unmounted, so don't wait for the next poll
+                now = time.time()
+                for diskDev in self.deviceDict.values():
+                    self.scheduler.schedule(diskDev.dev.id, 'poll', now)
 
-                lastIdentify  = [lastIdentify,  loopStart][doIdentify]
-                lastTouchDisk = [lastTouchDisk, loopStart][doTouchDisk]
+    #-------------------------------------------------------------------------------
+    def scheduleTask(self, diskDev, task, now):
+        if task == 'poll':
+            due = now + diskDev.pollFreq
+        elif task == 'identify':
+            due = now + self.identifyFreq
+        elif task == 'touch':
+            due = now + diskDev.touchDiskFreq * (1 + random.uniform(-k_touchJitter, k_touchJitter))
+        self.scheduler.schedule(diskDev.dev.id, task, due)
 
-                self.sleep( loopStart + self.stateLoopFreq - time.time() )
-        except self.StopThread:
-            pass    # Optionally catch the StopThread exception and do any needed cleanup.
+    #-------------------------------------------------------------------------------
+    def scheduleDevice(self, diskDev):
+        # the first poll of every device started with the plugin is done as one batch
+        now = time.time()
+        self.scheduler.schedule(diskDev.dev.id, 'poll', max(now, self.startupDue))
+        self.scheduleTask(diskDev, 'identify', now)
+        # stagger first touches across the whole interval so disks don't all spin up together
+        self.scheduler.schedule(diskDev.dev.id, 'touch', now + random.uniform(0, diskDev.touchDiskFreq))
 
     #-------------------------------------------------------------------------------
     # Device Methods
@@ -138,29 +379,58 @@ class Plugin(indigo.PluginBase):
         self.logger.debug("deviceStartComm: "+dev.name)
         if dev.version != self.pluginVersion:
             self.updateDeviceVersion(dev)
-        if dev.configured:
+        if dev.deviceTypeId == 'pluginStatus':
+            self.statusDict[dev.id] = dev
+            self._lastStatusUpdate = 0
+        elif dev.configured:
             if dev.deviceTypeId == 'localDisk':
                 self.deviceDict[dev.id] = LocalDiskDevice(dev, self)
             elif dev.deviceTypeId == 'networkDisk':
                 self.deviceDict[dev.id] = NetworkDiskDevice(dev, self)
-            self.deviceDict[dev.id].update(True)
+            # the server keeps every state across restarts, so those are what the first poll is compared with
+            self.triggers.seed(dev.id, dev.states)
+            self.scheduleDevice(self.deviceDict[dev.id])
 
     #-------------------------------------------------------------------------------
     def deviceStopComm(self, dev):
         self.logger.debug("deviceStopComm: "+dev.name)
         if dev.id in self.deviceDict:
+            self.deviceDict[dev.id].saveHistory()
+            self.deviceDict[dev.id].cancelScan()
             del self.deviceDict[dev.id]
+        if dev.id in self.statusDict:
+            del self.statusDict[dev.id]
+        self.scheduler.remove(dev.id)
+
+    #-------------------------------------------------------------------------------
+    def deviceDeleted(self, dev):
+        indigo.PluginBase.deviceDeleted(self, dev)
+        for fileName in (k_historyFileName(dev.id), k_scanFileName(dev.id)):
+            try:
+                os.remove(os.path.join(self.dataFolder, fileName))
+            except OSError:
+                pass
 
     #-------------------------------------------------------------------------------
     def validateDeviceConfigUi(self, valuesDict, deviceTypeId, devId, runtime=False):
         self.logger.debug("validateDeviceConfigUi: " + deviceTypeId)
         errorsDict = indigo.Dict()
 
+        if deviceTypeId == 'pluginStatus':
+            return (True, valuesDict)
+
         if not valuesDict.get('volumeName',''):
             errorsDict['volumeName'] = "Required"
         else:
             valuesDict['mountPoint'] = "/Volumes/"+valuesDict['volumeName']
 
+        for key in ('deadbandMegs', 'deadbandPercent'):
+            try:
+                if float(valuesDict.get(key,'0') or '0') < 0:
+                    errorsDict[key] = "Must not be negative"
+            except ValueError:
+                errorsDict[key] = "Must be a number"
+
         if deviceTypeId == 'networkDisk':
             if not valuesDict.get('volumeURL',''):
                 errorsDict['volumeURL'] = "Required"
@@ -191,6 +461,51 @@ class Plugin(indigo.PluginBase):
         dev.replacePluginPropsOnServer(theProps)
 
 
+    #-------------------------------------------------------------------------------
+    # Trigger Methods
+    #-------------------------------------------------------------------------------
+    def triggerStartProcessing(self, trigger):
+        self.logger.debug("triggerStartProcessing: "+trigger.name)
+        props = trigger.pluginProps
+        keyFormat, rising, level = k_triggerTypes[trigger.pluginTypeId]
+        try:
+            if level is None:
+                level = float(props['threshold'])
+            hysteresis = float(props.get('hysteresis','0') or '0')
+            self.triggers.add(trigger.id, int(props['device']), keyFormat.format(units=props.get('units','percent')), rising, level, hysteresis)
+        except (KeyError, ValueError):
+            self.logger.error('trigger "{0}" is not configured correctly'.format(trigger.name))
+
+    #-------------------------------------------------------------------------------
+    def triggerStopProcessing(self, trigger):
+        self.logger.debug("triggerStopProcessing: "+trigger.name)
+        self.triggers.remove(trigger.id)
+
+    #-------------------------------------------------------------------------------
+    def validateEventConfigUi(self, valuesDict, typeId, eventId):
+        self.logger.debug("validateEventConfigUi: " + typeId)
+        errorsDict = indigo.Dict()
+
+        if not valuesDict.get('device',''):
+            errorsDict['device'] = "Required"
+
+        if k_triggerTypes[typeId][2] is None:
+            for key in ('threshold', 'hysteresis'):
+                try:
+                    if float(valuesDict.get(key,'0') or '0') < 0:
+                        errorsDict[key] = "Must be zero or greater"
+                except ValueError:
+                    errorsDict[key] = "Must be a number"
+
+        if len(errorsDict) > 0:
+            return (False, valuesDict, errorsDict)
+        return (True, valuesDict)
+
+    #-------------------------------------------------------------------------------
+    def fireTriggers(self, devId, states):
+        for trigId in self.triggers.check(devId, states):
+            indigo.trigger.execute(trigId)
+
     #-------------------------------------------------------------------------------
     # Action Methods
     #-------------------------------------------------------------------------------
@@ -209,12 +524,113 @@ class Plugin(indigo.PluginBase):
         # STATUS REQUEST
         elif action.deviceAction == indigo.kUniversalAction.RequestStatus:
             self.logger.info('"{0}" status update'.format(dev.name))
-            self.refresh_data()
+            self.refresh_data(True, [diskDev])
             diskDev.update(True)
         # UNKNOWN
         else:
             self.logger.debug('"{0}" {1} request ignored'.format(dev.name, str(action.deviceAction)))
 
+    #-------------------------------------------------------------------------------
+    def validateActionConfigUi(self, valuesDict, typeId, devId):
+        self.logger.debug("validateActionConfigUi: " + typeId)
+        errorsDict = indigo.Dict()
+        if typeId == 'scanUsage':
+            self.validateTopCount(valuesDict, errorsDict)
+        if len(errorsDict) > 0:
+            return (False, valuesDict, errorsDict)
+        return (True, valuesDict)
+
+    #-------------------------------------------------------------------------------
+    def scanUsageAction(self, action, dev=None):
+        self.logger.debug("scanUsageAction")
+        if action.deviceId in self.deviceDict:
+            self.deviceDict[action.deviceId].scanUsage(int(action.props.get('topCount', k_scanTopCount)))
+
+    #-------------------------------------------------------------------------------
+    def cancelScanAction(self, action, dev=None):
+        self.logger.debug("cancelScanAction")
+        if action.deviceId in self.deviceDict:
+            self.deviceDict[action.deviceId].cancelScan()
+
+    #-------------------------------------------------------------------------------
+    def bulkStateAction(self, action):
+        self.logger.debug("bulkStateAction: "+action.pluginTypeId)
+        return self.bulkSetState(self.bulkDevices(action.props), k_bulkActions[action.pluginTypeId])
+
+    #-------------------------------------------------------------------------------
+    def bulkDevices(self, props):
+        selection = props.get('selection','devices')
+        if selection == 'devices':
+            devIds = [int(devId) for devId in props.get('devices',[])]
+            return [self.deviceDict[devId] for devId in devIds if devId in self.deviceDict]
+        return [diskDev for diskDev in self.deviceDict.values() if selection in ('all', diskDev.dev.deviceTypeId)]
+
+    #-------------------------------------------------------------------------------
+    def bulkSetState(self, diskDevs, newState=None):
+        # commands run concurrently on the executor, then everything is refreshed once
+        results = dict()
+        pending = list()
+        for diskDev in diskDevs:
+            target = (not diskDev.onState) if newState is None else newState
+            result = {'name':diskDev.name, 'action':['unmount','mount'][target], 'success':True, 'message':""}
+            results[str(diskDev.dev.id)] = result
+            if target == diskDev.onState:
+                result['message'] = "already {0}".format(['unmounted','mounted'][target])
+                continue
+            job = {'diskDev':diskDev, 'target':target, 'result':result, 'started':None, 'finished':None}
+            callback = lambda success, response, job=job: self.bulkResult(job, success, response)
+            started = lambda job=job: job.__setitem__('started', time.time())
+            if diskDev.submitState(target, callback, started):
+                self.logger.info('{0} volume "{1}"'.format(['unmounting','mounting'][target], diskDev.props['volumeName']))
+                pending.append(job)
+            else:
+                result['success'] = False
+                result['message'] = "busy"
+
+        self.bulkWait(pending)
+
+        with self.stats.timer('mount'):
+            self.refresh_data(diskDevs=diskDevs)
+            for diskDev in diskDevs:
+                diskDev.update()
+
+        failed = [result['name'] for result in results.values() if not result['success']]
+        if failed:
+            self.logger.error('bulk {0} failed for: {1}'.format(['unmount','mount','toggle'][newState if newState is not None else 2], ', '.join(failed)))
+        return results
+
+    #-------------------------------------------------------------------------------
+    def bulkResult(self, job, success, response):
+        # runs on an executor worker, so it only records the outcome and frees the worker
+        if not success:
+            job['result']['success'] = False
+            job['result']['message'] = response
+        job['finished'] = time.time()
+
+    #-------------------------------------------------------------------------------
+    def bulkWait(self, jobs):
+        # each job is timed from when a worker actually picked it up, and the mount points
+        # are polled here rather than by holding executor workers
+        delay = k_mountPollFirst
+        while jobs:
+            now = time.time()
+            for job in list(jobs):
+                diskDev, result = job['diskDev'], job['result']
+                if job['finished'] is None:
+                    if job['started'] is not None and now > job['started'] + k_commandTimeout + k_probeTimeout:
+                        result['success'] = False
+                        result['message'] = "timed out"
+                        jobs.remove(job)
+                elif not result['success'] or self.isMounted(diskDev.props['mountPoint']) == job['target']:
+                    jobs.remove(job)
+                elif now > job['finished'] + diskDev.mountWait:
+                    result['success'] = False
+                    result['message'] = "not yet {0} at {1}".format(['unmounted','mounted'][job['target']], diskDev.props['mountPoint'])
+                    jobs.remove(job)
+            if jobs:
+                time.sleep(delay)
+                delay = min(delay * 2, k_mountPollMax)
+
     #-------------------------------------------------------------------------------
     # Menu Methods
     #-------------------------------------------------------------------------------
@@ -226,32 +642,217 @@ class Plugin(indigo.PluginBase):
             self.debug = True
             self.logger.debug("Debug logging enabled")
 
+    #-------------------------------------------------------------------------------
+    def printPerformanceReport(self):
+        self.logger.info("performance over the last {0} samples of each phase:".format(k_statsSamples))
+        self.logger.info('{:>10} {:>7} {:>10} {:>10} {:>10}'.format('phase', 'count', 'min ms', 'avg ms', 'p95 ms'))
+        for phase in k_statsPhases:
+            summary = self.stats.summary(phase)
+            if summary:
+                self.logger.info('{:>10} {:>7} {:>10.1f} {:>10.1f} {:>10.1f}'.format(phase, *summary))
+        self.logger.info("'update' includes any statvfs, df and diskutil time spent while devices were updated")
+
+    #-------------------------------------------------------------------------------
+    def validateMenuConfigUi(self, valuesDict, typeId, menuId):
+        if typeId == 'scanDiskUsage':
+            return self.validateScanConfigUi(valuesDict, typeId)
+        return self.validateProfileConfigUi(valuesDict, typeId)
+
+    #-------------------------------------------------------------------------------
+    def validateProfileConfigUi(self, valuesDict, typeId):
+        errorsDict = indigo.Dict()
+        try:
+            if int(valuesDict.get('cycles','0')) < 1:
+                errorsDict['cycles'] = "Must be at least 1"
+        except ValueError:
+            errorsDict['cycles'] = "Must be a whole number"
+        if len(errorsDict) > 0:
+            return (False, valuesDict, errorsDict)
+        return (True, valuesDict)
+
+    #-------------------------------------------------------------------------------
+    def profileCycles(self, valuesDict, typeId):
+        self._profileRequest = int(valuesDict['cycles'])
+        self.logger.info("profiling the next {0} update cycles".format(self._profileRequest))
+        return True
+
+    #-------------------------------------------------------------------------------
+    def validateScanConfigUi(self, valuesDict, typeId):
+        errorsDict = indigo.Dict()
+        if int(valuesDict.get('device','0') or '0') not in self.deviceDict:
+            errorsDict['device'] = "Select an enabled disk"
+        self.validateTopCount(valuesDict, errorsDict)
+        if len(errorsDict) > 0:
+            return (False, valuesDict, errorsDict)
+        return (True, valuesDict)
+
+    #-------------------------------------------------------------------------------
+    def validateTopCount(self, valuesDict, errorsDict):
+        try:
+            if int(valuesDict.get('topCount','0')) < 1:
+                errorsDict['topCount'] = "Must be at least 1"
+        except ValueError:
+            errorsDict['topCount'] = "Must be a whole number"
+
+    #-------------------------------------------------------------------------------
+    def scanDiskUsage(self, valuesDict, typeId):
+        self.deviceDict[int(valuesDict['device'])].scanUsage(int(valuesDict['topCount']))
+        return True
+
+    #-------------------------------------------------------------------------------
+    def cancelDiskUsageScans(self):
+        for diskDev in self.deviceDict.values():
+            diskDev.cancelScan()
+
+    #-------------------------------------------------------------------------------
+    # Instrumentation
+    #-------------------------------------------------------------------------------
+    def startProfile(self):
+        # cProfile only sees the thread it runs on, so it is created on the concurrent thread
+        if self._profileRequest and not self._profiler:
+            self._profiler = cProfile.Profile()
+            self._profileCycles = self._profileRequest
+            self._profileRequest = 0
+        if self._profiler:
+            self._profiler.enable()
+
+    #-------------------------------------------------------------------------------
+    def stopProfile(self):
+        if self._profiler:
+            self._profiler.disable()
+            self._profileCycles -= 1
+            if self._profileCycles <= 0:
+                self.saveProfile()
+
+    #-------------------------------------------------------------------------------
+    def saveProfile(self):
+        folder = os.path.join(indigo.server.getInstallFolderPath(), 'Logs', self.pluginId)
+        path = os.path.join(folder, k_profileFileName(time.strftime('%Y%m%d-%H%M%S')))
+        try:
+            if not os.path.isdir(folder):
+                os.makedirs(folder)
+            self._profiler.dump_stats(path)
+            self.logger.info("profile saved to {0}".format(path))
+        except (IOError, OSError) as e:
+            self.logger.error("unable to save profile: {0}".format(e))
+        self._profiler = None
+
+    #-------------------------------------------------------------------------------
+    @property
+    def dataFolder(self):
+        folder = os.path.join(indigo.server.getInstallFolderPath(), 'Preferences', 'Plugins', self.pluginId)
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        return folder
+
+    #-------------------------------------------------------------------------------
+    def startMetrics(self, enabled, port=k_metricsPort):
+        # (re)start the listener only when the setting actually changed
+        if self.metrics and (not enabled or port != self.metrics.port):
+            self.metrics.stop()
+            self.metrics = None
+        if enabled and not self.metrics:
+            metrics = MetricsServer(self.logger, port)
+            if metrics.start():
+                metrics.publish(self.deviceDict.values())
+                self.metrics = metrics
+
+    #-------------------------------------------------------------------------------
+    def updateStatusDevices(self):
+        now = time.time()
+        if self.statusDict and now >= self._lastStatusUpdate + k_statusFreq:
+            newStates = [{'key':'cycles', 'value':self.stats.count('cycle')}]
+            for phase in k_statusPhases:
+                summary = self.stats.summary(phase) or (0, 0, 0, 0)
+                newStates.append({'key':phase+'_avg_ms', 'value':round(summary[2],1), 'uiValue':'{0:.1f} ms'.format(summary[2])})
+                newStates.append({'key':phase+'_p95_ms', 'value':round(summary[3],1), 'uiValue':'{0:.1f} ms'.format(summary[3])})
+            for dev in self.statusDict.values():
+                dev.updateStatesOnServer(newStates)
+            self._lastStatusUpdate = now
 
     #-------------------------------------------------------------------------------
     # Properties
     #-------------------------------------------------------------------------------
     @property
     def dfResults(self):
-        if self._dfRefresh:
-            success, data = do_shell_script(k_dfGetDataCmd)
-            if success:
-                self._dfData = data
-                self._dfRefresh = False
-        return self._dfData
+        with self.dataLock:
+            if self._dfRefresh:
+                with self.stats.timer('df'):
+                    success, data = do_shell_script(k_dfGetDataCmd)
+                if success:
+                    with self.stats.timer('parse'):
+                        self._dfData = DfSnapshot(data)
+                    self._dfRefresh = False
+            return self._dfData
 
     #-------------------------------------------------------------------------------
     @property
     def duResults(self):
-        if self._duRefresh:
-            success, data = do_shell_script(k_duGetDataCmd)
-            if success:
-                self._duData = data
-                self._duRefresh = False
-        return self._duData
+        with self.dataLock:
+            if self._duRefresh:
+                with self.stats.timer('diskutil'):
+                    success, data = do_shell_script(k_duGetDataCmd)
+                if success:
+                    with self.stats.timer('parse'):
+                        self._duData = DuSnapshot(data)
+                    self._duRefresh = False
+            return self._duData
+
+    #-------------------------------------------------------------------------------
+    @property
+    def svResults(self):
+        with self.dataLock:
+            if self._svPending:
+                with self.stats.timer('statvfs'):
+                    self._svData.refresh(self._svPending, self.mountTable, self.statvfsProbe)
+                self._svPending = set()
+            return self._svData
 
     #-------------------------------------------------------------------------------
-    def refresh_data(self):
-        self._dfRefresh = self._duRefresh = True
+    @property
+    def mountTable(self):
+        # filesystem types only change with the mount table, so it is read again only then
+        with self.dataLock:
+            if self._mtRefresh:
+                self._mtData = mount_table()
+                self._mtRefresh = False
+            return self._mtData
+
+    #-------------------------------------------------------------------------------
+    def mountedElsewhere(self, identifier, mountPoint):
+        # df is only worth forking for a volume the mount table shows at an unexpected path
+        mounts = self.mountTable
+        if not mounts.byMountPoint:
+            return True
+        return any(path != mountPoint for path in mounts.bySource.get(identifier, ()))
+
+    #-------------------------------------------------------------------------------
+    def isMounted(self, mountPoint):
+        # ismount can hang on a dead server, so the check goes through the statvfs probe's deadline
+        with self.dataLock:
+            return self.statvfsProbe.query([mountPoint]).get(mountPoint) is not None
+
+    #-------------------------------------------------------------------------------
+    def refresh_data(self, identify=False, diskDevs=None):
+        # usage always changes, but diskutil only needs to run when the mount table has;
+        # statvfs is only paid for the devices about to be updated
+        if diskDevs is None:
+            diskDevs = self.deviceDict.values()
+        with self.dataLock:
+            self._dfRefresh = True
+            self._svPending.update(diskDev.props['mountPoint'] for diskDev in diskDevs)
+            if self.checkMounts() or identify:
+                self._duRefresh = self._mtRefresh = True
+
+    #-------------------------------------------------------------------------------
+    def checkMounts(self):
+        with self.dataLock:
+            if self.mountWatcher.changed():
+                self.logger.debug("mount table changed")
+                self.mountGeneration += 1
+                self._duRefresh = self._mtRefresh = True
+                return True
+            return False
 
 
 
@@ -266,67 +867,323 @@ class DiskDevice(object):
         self.name       = self.dev.name
         self.props      = self.dev.pluginProps
         self.states     = self.dev.states
+        self._published = dict(self.states)
 
         self.plugin     = plugin
         self.logger     = plugin.logger
-        self.sleep      = plugin.sleep
+        self.lock       = threading.RLock()
+
+        self.touchPath  = os.path.join(self.props['mountPoint'], k_touchFileName)
+        self._touchThread   = None
+        self._lastMegsUsed  = None
+        self._lastActive    = 0
+
+        self._pollFreq      = int(self.props.get('pollFreq','0'))
+        self._touchDiskFreq = int(self.props.get('touchDiskFreq','0'))*60
 
-        self.touchCmd   = k_touchDiskCmd( mountpoint = cmd_quote(self.props['mountPoint']) )
+        self.autoRemount        = self.props.get('autoRemount',False)
+        self._wantMounted       = bool(self.states['onOffState'])
+        self._remountDelay      = 0
+        self._remountPending    = False
+        self._mountCheck        = None
 
-        self._dfInfo    = ""
+        self.deadbandMegs       = float(self.props.get('deadbandMegs','0') or '0')
+        self.deadbandPercent    = float(self.props.get('deadbandPercent','0') or '0')
+        self.minPublishSecs     = int(self.props.get('minPublishSecs','0'))
+        self._lastPublish       = 0
+
+        self._dfInfo    = None
         self._refresh   = True
+        self._mountGeneration = plugin.mountGeneration
+
+        self.history    = self.loadHistory()
+        self._scanCancel = threading.Event()
 
 
     #-------------------------------------------------------------------------------
     def update(self, doIdentify=False, doTouchDisk=False):
-        self._refresh = True
-        if not self.states['identifier'] or doIdentify:
-            self.getIdentifier()
-
-        self.states['onOffState'] = bool(self.dfInfo)
-
-        if self.onState:
-            diskStats = regextract(self.dfInfo, k_dfInfoGroupsRegex, k_dfInfoGroupsKeys)
-            self.states['megs_total']   = int(diskStats['size'])
-            self.states['megs_used']    = int(diskStats['used'])
-            self.states['megs_free']    = int(diskStats['free'])
-            self.states['percent_used'] = int(diskStats['percent'])
-            self.states['percent_free'] = 100-int(diskStats['percent'])
-            self.states['size_total']   = mb_to_string(int(diskStats['size']))
-            self.states['size_used']    = mb_to_string(int(diskStats['used']))
-            self.states['size_free']    = mb_to_string(int(diskStats['free']))
-
-        if doTouchDisk:
-            if self.props['preventSleep'] and self.onState:
-                self.logger.debug('touching file on volume "{0}"'.format(self.props['volumeName']))
-                success, response = do_shell_script(self.touchCmd)
-                if success:
-                    self.states['last_touch'] = time.strftime('%Y-%m-%d %T')
-                else:
-                    self.logger.error('touch disk "{0}" failed'.format(self.props['volumeName']))
-                    self.logger.debug(response)
-
-        newStates = list()
-        for key, value in self.states.iteritems():
-            if self.states[key] != self.dev.states[key]:
-                if key in ['percent_free','percent_used']:
-                    newStates.append({'key':key,'value':value, 'uiValue': '{0}%'.format(value)})
-                elif key in ['megs_free','megs_used','megs_total']:
-                    newStates.append({'key':key,'value':value, 'uiValue': '{0} MB'.format(value)})
+        with self.lock:
+            self._refresh = True
+            if not self.states['identifier'] or doIdentify or self._mountGeneration != self.plugin.mountGeneration:
+                self._mountGeneration = self.plugin.mountGeneration
+                self.getIdentifier(doIdentify)
+
+            self.states['onOffState'] = self.dfInfo is not None
+
+            if self.onState:
+                diskStats = self.dfInfo
+                if self._lastMegsUsed is not None and diskStats['used'] != self._lastMegsUsed:
+                    self._lastActive = time.time()
+                self._lastMegsUsed = diskStats['used']
+                self.states['megs_total']   = diskStats['size']
+                self.states['megs_used']    = diskStats['used']
+                self.states['megs_free']    = diskStats['free']
+                self.states['percent_used'] = diskStats['percent']
+                self.states['percent_free'] = 100-diskStats['percent']
+                self.states['inodes_free']  = diskStats['inodes_free']
+                self.states['percent_inodes_used'] = diskStats['inodes_percent']
+                self.states['read_only']    = diskStats['read_only']
+                self.states['fs_type']      = diskStats['fs_type']
+
+                if self.history.add(time.time(), diskStats['used']):
+                    self.saveHistory()
+                rate = self.history.fillRate()
+                self.states['fill_rate_mb_per_hour'] = round(rate, 1) if rate is not None else 0
+                self.states['hours_to_full'] = round(diskStats['free'] / rate, 1) if rate is not None and rate > 0 else -1
+
+            if doTouchDisk:
+                if self.props['preventSleep'] and self.onState:
+                    if self.recentlyActive():
+                        self.logger.debug('volume "{0}" recently active, touch skipped'.format(self.props['volumeName']))
+                    else:
+                        self.logger.debug('touching file on volume "{0}"'.format(self.props['volumeName']))
+                        if not self.plugin.executor.submit(self.dev.id, self.touchJob, self.touchResult):
+                            self.logger.debug('volume "{0}" busy, touch skipped'.format(self.props['volumeName']))
+
+            self.checkRemount()
+            self.publishStates()
+            self.plugin.fireTriggers(self.dev.id, self.states)
+
+    #-------------------------------------------------------------------------------
+    def checkRemount(self):
+        # back off exponentially with jitter so a rebooting server isn't hit by every disk at once
+        with self.lock:
+            if self.onState:
+                self._remountDelay = 0
+                if not self.plugin.executor.busy(self.dev.id):
+                    self._wantMounted = True
+            elif self.autoRemount and self._wantMounted and not self._remountPending and not self._mountCheck:
+                self._remountDelay = min(max(self._remountDelay * 2, k_remountFirst), k_remountMax)
+                due = time.time() + self._remountDelay * (1 + random.uniform(-k_remountJitter, k_remountJitter))
+                self.plugin.scheduler.schedule(self.dev.id, 'remount', due)
+                self._remountPending = True
+
+    #-------------------------------------------------------------------------------
+    def remount(self):
+        with self.lock:
+            self._remountPending = False
+            if self.onState or not (self.autoRemount and self._wantMounted):
+                return
+        self.logger.info('remounting volume "{0}"'.format(self.props['volumeName']))
+        if not self.submitState(True, self.remountResult):
+            self.checkRemount()
+
+    #-------------------------------------------------------------------------------
+    def remountResult(self, success, response):
+        if success:
+            self.onStateResult(True, success, response)
+        else:
+            self.logger.debug('remount of volume "{0}" failed: {1}'.format(self.props['volumeName'], response))
+            self.checkRemount()
+
+    #-------------------------------------------------------------------------------
+    def publishStates(self):
+        with self.lock:
+            changed = [key for key in self.states if key not in k_sizeStrings and self.states[key] != self._published.get(key)]
+            if not changed:
+                return
+
+            # capacity is held back until it moves past the deadband, except when the disk turns on or off
+            now = time.time()
+            keys = [key for key in changed if key not in k_capacityKeys]
+            if len(keys) < len(changed):
+                if 'onOffState' in keys or (now >= self._lastPublish + self.minPublishSecs and self.exceedsDeadband()):
+                    for key, megsKey in k_sizeStrings.items():
+                        self.states[key] = mb_to_string(self.states[megsKey])
+                    keys = [key for key in self.states if self.states[key] != self._published.get(key)]
+                    self._lastPublish = now
+            if not keys:
+                return
+
+            newStates = list()
+            for key in keys:
+                value = self.states[key]
+                if key in k_stateFormatters:
+                    newStates.append({'key':key,'value':value, 'uiValue': k_stateFormatters[key](value)})
                 else:
                     newStates.append({'key':key,'value':value})
+                self._published[key] = value
 
                 if key == 'onOffState':
                     self.logger.info('"{0}" {1}'.format(self.name, ['off','on'][value]))
                     self.dev.updateStateImageOnServer(k_diskStatusImage[value])
 
-        if len(newStates) > 0:
             if self.plugin.debug: # don't fill up plugin log unless actively debugging
                 self.logger.debug('updating states on device "{0}":'.format(self.name))
                 for item in newStates:
                     self.logger.debug('{:>16}: {}'.format(item['key'],item['value']))
-            self.dev.updateStatesOnServer(newStates)
-            self.states = self.dev.states
+            with self.plugin.stats.timer('server'):
+                self.dev.updateStatesOnServer(newStates)
+
+    #-------------------------------------------------------------------------------
+    def exceedsDeadband(self):
+        if not (self.deadbandMegs or self.deadbandPercent):
+            return True
+        if self.deadbandMegs:
+            for key in k_deadbandMegKeys:
+                if abs(self.states[key] - (self._published.get(key) or 0)) >= self.deadbandMegs:
+                    return True
+        if self.deadbandPercent:
+            for key in k_deadbandPctKeys:
+                if abs(self.states[key] - (self._published.get(key) or 0)) >= self.deadbandPercent:
+                    return True
+        return False
+
+    #-------------------------------------------------------------------------------
+    def verifyMount(self, now):
+        # runs on the concurrent thread after update(), with exponential backoff so fast mounts
+        # report at once and slow network mounts are still caught before the next scheduled poll;
+        # returns whether the check is still pending
+        with self.lock:
+            check = self._mountCheck
+            if not check:
+                return False
+            if self.onState == check['target']:
+                self.plugin.stats.add('mount', now - check['finished'])
+            elif now > check['finished'] + self.mountWait:
+                self.logger.debug('volume "{0}" not yet {1} at {2}'.format(self.props['volumeName'],
+                                    ['unmounted','mounted'][check['target']], self.props['mountPoint']))
+            else:
+                self.plugin.scheduler.schedule(self.dev.id, 'verify', now + check['delay'])
+                check['delay'] = min(check['delay'] * 2, k_mountPollMax)
+                return True
+            self._mountCheck = None
+            return False
+
+    #-------------------------------------------------------------------------------
+    def snapshot(self):
+        with self.lock:
+            return dict(self.states)
+
+
+    #-------------------------------------------------------------------------------
+    def loadHistory(self):
+        fineSize = min(k_historyFineMax, max(k_historyMinSamples, k_historyFineSecs // self.pollFreq))
+        try:
+            with open(self.historyPath, 'rb') as historyFile:
+                return UsageHistory.loads(historyFile.read(), fineSize)
+        except (IOError, OSError):
+            return UsageHistory(fineSize)
+
+    #-------------------------------------------------------------------------------
+    def saveHistory(self):
+        # write then rename so a crash mid-save can't leave a truncated file
+        with self.lock:
+            data = self.history.dumps()
+        try:
+            path = self.historyPath
+            with open(path + '.tmp', 'wb') as historyFile:
+                historyFile.write(data)
+            os.rename(path + '.tmp', path)
+        except (IOError, OSError) as e:
+            self.logger.debug('unable to save history for "{0}": {1}'.format(self.name, e))
+
+    #-------------------------------------------------------------------------------
+    @property
+    def historyPath(self):
+        return os.path.join(self.plugin.dataFolder, k_historyFileName(self.dev.id))
+
+    #-------------------------------------------------------------------------------
+    def recentlyActive(self):
+        # usage changing within the same window touch_file allows the touch file's mtime means
+        # the disk is awake; checking the file itself is I/O, so that is left to touchJob
+        return time.time() - self._lastActive < self.touchDiskFreq / 2
+
+    #-------------------------------------------------------------------------------
+    def touchJob(self):
+        # the write runs on its own thread so a wedged volume can't hold an executor worker
+        if self._touchThread and self._touchThread.is_alive():
+            return False, "previous touch still pending"
+        result = list()
+        self._touchThread = threading.Thread(target=touch_file, args=(self.touchPath, result, self.touchDiskFreq / 2))
+        self._touchThread.daemon = True
+        self._touchThread.start()
+        self._touchThread.join(k_touchTimeout)
+        if result:
+            return result[0]
+        return False, "timed out after {0} seconds".format(k_touchTimeout)
+
+    #-------------------------------------------------------------------------------
+    def touchResult(self, success, response):
+        if success and response is None:
+            self.logger.debug('volume "{0}" touched by another writer, touch skipped'.format(self.props['volumeName']))
+        elif success:
+            self.plugin.stats.add('touch', response)
+            with self.lock:
+                self.states['last_touch'] = time.strftime('%Y-%m-%d %T')
+                self.states['touch_latency_ms'] = int(round(response * 1000))
+                self.publishStates()
+        else:
+            self.logger.error('touch disk "{0}" failed'.format(self.props['volumeName']))
+            self.logger.debug(response)
+
+    #-------------------------------------------------------------------------------
+    def scanUsage(self, topCount=k_scanTopCount):
+        if not self.onState:
+            self.logger.info('volume "{0}" is not mounted, directory scan skipped'.format(self.props['volumeName']))
+            return False
+        # each scan gets its own event, so a refused request can't undo a cancel of the running scan
+        cancel = threading.Event()
+        if not self.plugin.scanPool.submit(self.dev.id, lambda: self.scanJob(topCount, cancel), self.scanResult):
+            self.logger.info('directory scan of volume "{0}" already running'.format(self.props['volumeName']))
+            return False
+        self._scanCancel = cancel
+        self.logger.info('scanning directory usage on volume "{0}"'.format(self.props['volumeName']))
+        with self.lock:
+            self.states['scan_status'] = 'scanning'
+            self.publishStates()
+        return True
+
+    #-------------------------------------------------------------------------------
+    def cancelScan(self):
+        if self.plugin.scanPool.busy(self.dev.id):
+            self.logger.info('cancelling directory scan of volume "{0}"'.format(self.props['volumeName']))
+            self._scanCancel.set()
+
+    #-------------------------------------------------------------------------------
+    def scanJob(self, topCount, cancel):
+        # runs on the scan pool; the cache from the last scan lets unchanged directories skip listing
+        path = os.path.join(self.plugin.dataFolder, k_scanFileName(self.dev.id))
+        scanner = DirectoryScanner(self.props['mountPoint'], load_json(read_file(path)), cancel)
+        start = time.time()
+        if not scanner.scan():
+            return (False, 'cancelled' if cancel.is_set() else 'failed')
+        try:
+            with open(path + '.tmp', 'w') as scanFile:
+                scanFile.write(scanner.dumps())
+            os.rename(path + '.tmp', path)
+        except (IOError, OSError) as e:
+            self.logger.debug('unable to save directory scan for "{0}": {1}'.format(self.name, e))
+        self.logger.debug('scanned {0} directories ({1} listed) on volume "{2}" in {3:.1f} s'.format(
+                            len(scanner.totals), scanner.listed, self.props['volumeName'], time.time() - start))
+        return (True, scanner.top(topCount))
+
+    #-------------------------------------------------------------------------------
+    def scanResult(self, success, response):
+        if success:
+            self.logger.info('largest directories on volume "{0}":'.format(self.props['volumeName']))
+            for path, megs in response:
+                self.logger.info('{0:>12}  {1}'.format(mb_to_string(megs), path))
+        else:
+            self.logger.info('directory scan of volume "{0}" {1}'.format(self.props['volumeName'], response))
+        with self.lock:
+            self.states['scan_status'] = 'done' if success else response
+            if success:
+                self.states['last_scan'] = time.strftime('%Y-%m-%d %T')
+                self.states['largest_dir'], self.states['largest_dir_megs'] = response[0] if response else ('', 0)
+            self.publishStates()
+
+    #-------------------------------------------------------------------------------
+    def onStateResult(self, newState, success, response):
+        if success:
+            self.logger.info('{0} volume "{1}"'.format(['unmounted','mounted'][newState], self.props['volumeName']))
+            # runs on an executor worker, so the mount point is left to verifyMount on the concurrent thread
+            with self.lock:
+                self._mountCheck = {'target':newState, 'finished':time.time(), 'delay':k_mountPollFirst}
+            self.plugin.scheduler.schedule(self.dev.id, 'verify', time.time())
+        else:
+            self.logger.error('failed to {0} volume "{1}"'.format(['unmount','mount'][newState], self.props['volumeName']))
+            self.logger.debug(response)
 
 
     #-------------------------------------------------------------------------------
@@ -337,69 +1194,101 @@ class DiskDevice(object):
 
     def onStateSet(self,newState):
         if newState != self.onState:
-            success, response = do_shell_script(self.onOffCmds[newState])
-            if success:
+            callback = lambda success, response: self.onStateResult(newState, success, response)
+            if self.submitState(newState, callback):
                 self.logger.info('{0} volume "{1}"'.format(['unmounting','mounting'][newState], self.props['volumeName']))
-                self.plugin.refresh_data()
-                self.sleep(0.25)
-                self.update()
             else:
-                self.logger.error('failed to {0} volume "{1}"'.format(['unmount','mount'][newState], self.props['volumeName']))
-                self.logger.debug(response)
+                self.logger.error('volume "{0}" busy, {1} request refused'.format(self.props['volumeName'], ['unmount','mount'][newState]))
 
     onState = property(onStateGet, onStateSet)
 
+    #-------------------------------------------------------------------------------
+    def submitState(self, newState, callback, started=None):
+        if self.plugin.executor.submit(self.dev.id, self.onOffJobs[newState], callback, started=started):
+            self._wantMounted = newState
+            return True
+        return False
+
     #-------------------------------------------------------------------------------
     @property
     def dfInfo(self):
         if self._refresh:
-            match = re.search(self.dfPattern, self.plugin.dfResults, re.MULTILINE)
-            if match:
-                self._dfInfo = match.group(0)
-            else:
-                self._dfInfo = ""
+            self._dfInfo = None
+            identifier = self.states['identifier']
+            if self.plugin.capacityMethod == 'statvfs':
+                self._dfInfo = self.plugin.svResults.byMountPoint.get(self.props['mountPoint'])
+                if self._dfInfo is None and identifier and self.plugin.mountedElsewhere(identifier, self.props['mountPoint']):
+                    self._dfInfo = self.plugin.dfResults.byIdentifier.get(identifier)
+            elif identifier:
+                self._dfInfo = self.plugin.dfResults.byIdentifier.get(identifier)
             self._refresh = False
         return self._dfInfo
 
     #-------------------------------------------------------------------------------
     @property
-    def dfPattern(self):
-        if self.states['identifier']:
-            return k_dfSearchExp( identifier = self.states['identifier'] )
-        else:
-            return k_dfSearchNull
+    def pollFreq(self):
+        return self._pollFreq or self.plugin.stateLoopFreq
+
+    #-------------------------------------------------------------------------------
+    @property
+    def touchDiskFreq(self):
+        return self._touchDiskFreq or self.plugin.touchDiskFreq
 
     #-------------------------------------------------------------------------------
     @property
     def onOffCmds(self):
         return (self.offCmd,self.onCmd)
 
+    #-------------------------------------------------------------------------------
+    @property
+    def onOffJobs(self):
+        return self.onOffCmds
+
     #-------------------------------------------------------------------------------
     # abstract methods
     #-------------------------------------------------------------------------------
-    def getIdentifier(self):
+    def getIdentifier(self, force=False):
         raise NotImplementedError
 
+    #-------------------------------------------------------------------------------
+    def setCommands(self):
+        pass
+
 ###############################################################################
 class LocalDiskDevice(DiskDevice):
 
+    mountWait = k_mountWaitLocal
+
     #-------------------------------------------------------------------------------
     def __init__(self, instance, plugin):
         super(LocalDiskDevice, self).__init__(instance, plugin)
-        self.onCmd = self.offCmd = k_returnFalseCmd( message = "not available" )
-        self._ident = self.states['identifier']
+        self._ident = None
+        self.setCommands()
 
     #-------------------------------------------------------------------------------
-    def getIdentifier(self):
+    def getIdentifier(self, force=False):
         self.logger.debug('getting identifier for volume "{0}"'.format(self.props['volumeName']))
-        self.states['identifier'] = ""
-        for line in self.duInfo[::-1]:
-            diskStats = regextract(line, k_duInfoGroupsRegex, k_duInfoGroupsKeys)
-            if diskStats['type'] != 'Apple_CoreStorage':
-                self.states['disk_type']    = diskStats['type']
-                self.states['identifier']   = "/dev/" + diskStats['identifier']
-                break
+        diskStats = None
+        if not force:
+            # a cached identifier is only trusted if it is the device actually mounted
+            diskStats = self.plugin.identifierCache.lookup(self.states['volume_uuid'], self.props['volumeName'])
+            if diskStats and not device_is_mounted_at("/dev/" + diskStats['identifier'], self.props['mountPoint']):
+                diskStats = None
+        if diskStats is None:
+            diskStats = self.duInfo
+            if diskStats:
+                self.plugin.identifierCache.store(diskStats)
+
+        if diskStats:
+            self.states['disk_type']    = diskStats['type']
+            self.states['identifier']   = "/dev/" + diskStats['identifier']
+            self.states['volume_uuid']  = diskStats.get('uuid','')
+        else:
+            self.states['identifier']   = ""
+        self.setCommands()
 
+    #-------------------------------------------------------------------------------
+    def setCommands(self):
         if self.states['identifier'] != self._ident:
             if self.states['identifier']:
                 self.onCmd  = k_localMountCmd(      identifier  = cmd_quote(self.states['identifier']))
@@ -412,12 +1301,13 @@ class LocalDiskDevice(DiskDevice):
     #-------------------------------------------------------------------------------
     @property
     def duInfo(self):
-        pattern = k_duSearchExp(volumename = self.props['volumeName'])
-        return re.findall(pattern, self.plugin.duResults, re.MULTILINE)
+        return self.plugin.duResults.resolve(self.states['volume_uuid'], self.props['volumeName'])
 
 ###############################################################################
 class NetworkDiskDevice(DiskDevice):
 
+    mountWait = k_mountWaitNetwork
+
     #-------------------------------------------------------------------------------
     def __init__(self, instance, plugin):
         super(NetworkDiskDevice, self).__init__(instance, plugin)
@@ -426,7 +1316,7 @@ class NetworkDiskDevice(DiskDevice):
         identifier = '//'
         if parsed.username: identifier += pathname2url(parsed.username) + '@'
         if parsed.hostname: identifier += parsed.hostname
-        if parsed.port:     identifier += ':' + parsed.port
+        if parsed.port:     identifier += ':' + str(parsed.port)
         if parsed.path:     identifier += pathname2url(parsed.path)
         self.states['identifier'] = identifier
         self.states['disk_type']  = parsed.scheme
@@ -441,23 +1331,1131 @@ class NetworkDiskDevice(DiskDevice):
         self.offCmd = k_networkUnmountCmd(  identifier  = cmd_quote(identifier),
                                             force       = ['','-f'][self.props['forceUnmount']] )
 
+        self.host   = parsed.hostname
+        self.ports  = (parsed.port,) if parsed.port else k_schemePorts.get(parsed.scheme, ())
+
     #-------------------------------------------------------------------------------
-    def getIdentifier(self):
+    def getIdentifier(self, force=False):
         pass
 
+    #-------------------------------------------------------------------------------
+    def mountJob(self):
+        # probe first, so an offline server fails in about a second instead of hanging mount
+        if self.host and self.ports and not self.plugin.probe.reachable(self.host, self.ports):
+            return False, 'server "{0}" is not reachable'.format(self.host)
+        return do_shell_script(self.onCmd)
+
+    #-------------------------------------------------------------------------------
+    @property
+    def onOffJobs(self):
+        return (self.offCmd,self.mountJob)
+
+###############################################################################
+class DfSnapshot(object):
+
+    #-------------------------------------------------------------------------------
+    def __init__(self, data=""):
+        self.byIdentifier   = dict()
+        self.byMountPoint   = dict()
+        self.byVolumeName   = dict()
+        for line in data.splitlines():
+            diskStats = regextract(line, k_dfInfoGroupsRegex, k_dfInfoGroupsKeys)
+            if diskStats:
+                for key in k_dfInfoIntKeys:
+                    diskStats[key] = int(diskStats[key] or 0)
+                diskStats['inodes_total']   = diskStats['iused'] + diskStats['ifree']
+                diskStats['inodes_free']    = diskStats['ifree']
+                diskStats['inodes_percent'] = diskStats['ipercent']
+                diskStats['read_only']      = False
+                diskStats['fs_type']        = ""
+                self.byIdentifier[diskStats['identifier']] = diskStats
+                self.byMountPoint[diskStats['mountpoint']] = diskStats
+                volumeName = os.path.basename(diskStats['mountpoint'])
+                if volumeName:
+                    self.byVolumeName[volumeName] = diskStats
+                continue
+            # mount lines follow the df lines, so the volumes they describe are already known
+            mountInfo = regextract(line, k_mountGroupsRegex, k_mountGroupsKeys)
+            if mountInfo and mountInfo['mountpoint'] in self.byMountPoint:
+                options = [option.strip() for option in mountInfo['options'].split(',')]
+                diskStats = self.byMountPoint[mountInfo['mountpoint']]
+                diskStats['fs_type']   = mountInfo['fstype'] or options[0]
+                diskStats['read_only'] = any(option in k_readOnlyOptions for option in options)
+
+###############################################################################
+class StatvfsSnapshot(object):
+
+    #-------------------------------------------------------------------------------
+    def __init__(self):
+        self.byMountPoint   = dict()
+
+    #-------------------------------------------------------------------------------
+    def refresh(self, mountPoints, mountTable, probe):
+        # only the given mount points are re-read; the rest keep their last results,
+        # and a hung mount point reads as not mounted
+        results = probe.query(mountPoints)
+        for mountPoint in mountPoints:
+            diskStats = results.get(mountPoint)
+            if diskStats:
+                fsType, readOnly = mountTable.byMountPoint.get(mountPoint, ("", False))
+                diskStats['fs_type'] = fsType or diskStats['fs_type']
+                diskStats['read_only'] = diskStats['read_only'] or readOnly
+                self.byMountPoint[mountPoint] = diskStats
+            else:
+                self.byMountPoint.pop(mountPoint, None)
+
+###############################################################################
+class MountTable(object):
+
+    #-------------------------------------------------------------------------------
+    def __init__(self, mounts=()):
+        # mounts are (source, mount point, fs type, read only)
+        self.byMountPoint   = dict()
+        self.bySource       = dict()
+        for source, mountPoint, fsType, readOnly in mounts:
+            self.byMountPoint[mountPoint] = (fsType, readOnly)
+            self.bySource.setdefault(source, []).append(mountPoint)
+
+###############################################################################
+class StatvfsProbe(object):
+
+    #-------------------------------------------------------------------------------
+    def __init__(self, timeout=k_statvfsTimeout):
+        self.timeout    = timeout
+        self._hung      = dict()
+
+    #-------------------------------------------------------------------------------
+    def query(self, mountPoints):
+        # statvfs runs on a worker so a dead server can't stall the caller; a mount point
+        # that misses its deadline is left to its worker and skipped until that call returns
+        results = dict()
+        pending = collections.deque(mountPoint for mountPoint in mountPoints if not self.hung(mountPoint))
+        while pending:
+            done = Queue.Queue()
+            abandoned = threading.Event()
+            worker = threading.Thread(target=self._worker, args=(list(pending), done, abandoned), name='StatvfsProbe')
+            worker.daemon = True
+            worker.start()
+            while pending:
+                try:
+                    mountPoint, diskStats = done.get(timeout=self.timeout)
+                except Queue.Empty:
+                    abandoned.set()
+                    self._hung[pending.popleft()] = worker
+                    break
+                pending.popleft()
+                results[mountPoint] = diskStats
+        return results
+
+    #-------------------------------------------------------------------------------
+    def hung(self, mountPoint):
+        worker = self._hung.get(mountPoint)
+        if worker and worker.is_alive():
+            return True
+        self._hung.pop(mountPoint, None)
+        return False
+
+    #-------------------------------------------------------------------------------
+    @staticmethod
+    def _worker(mountPoints, done, abandoned):
+        for mountPoint in mountPoints:
+            if abandoned.is_set():
+                break
+            done.put((mountPoint, statvfs_info(mountPoint)))
+
+###############################################################################
+class DuSnapshot(object):
+
+    #-------------------------------------------------------------------------------
+    def __init__(self, data=""):
+        self.byIdentifier   = dict()
+        self.byVolumeName   = dict()
+        self.byUUID         = dict()
+        if data.lstrip().startswith('<?xml'):
+            self.parsePlist(data)
+        else:
+            self.parseText(data)
+
+    #-------------------------------------------------------------------------------
+    def parseText(self, data):
+        for line in data.splitlines():
+            diskStats = regextract(line, k_duInfoGroupsRegex, k_duInfoGroupsKeys)
+            if diskStats:
+                self.add(diskStats)
+
+    #-------------------------------------------------------------------------------
+    def parsePlist(self, data):
+        try:
+            plist = plistlib.readPlistFromString(data)
+        except Exception:
+            return
+        for disk in plist.get('AllDisksAndPartitions', []):
+            if 'VolumeName' in disk:
+                self.addPlistEntry(disk, disk.get('Content',''))
+            for partition in disk.get('Partitions', []):
+                self.addPlistEntry(partition, partition.get('Content',''))
+            for volume in disk.get('APFSVolumes', []):
+                self.addPlistEntry(volume, k_duApfsVolumeType)
+
+    #-------------------------------------------------------------------------------
+    def addPlistEntry(self, entry, diskType):
+        self.add({  'type'          : diskType,
+                    'name'          : entry.get('VolumeName',''),
+                    'size'          : entry.get('Size',0),
+                    'identifier'    : entry.get('DeviceIdentifier',''),
+                    'uuid'          : entry.get('VolumeUUID',''),
+                    'mountpoint'    : entry.get('MountPoint',''),
+                    })
+
+    #-------------------------------------------------------------------------------
+    def add(self, diskStats):
+        self.byIdentifier[diskStats['identifier']] = diskStats
+        self.byVolumeName.setdefault(diskStats['name'], list()).append(diskStats)
+        if diskStats.get('uuid'):
+            self.byUUID[diskStats['uuid']] = diskStats
+
+    #-------------------------------------------------------------------------------
+    def resolve(self, uuid, volumeName):
+        if uuid in self.byUUID:
+            return self.byUUID[uuid]
+        for diskStats in self.byVolumeName.get(volumeName, [])[::-1]:
+            if diskStats['type'] not in k_duContainerTypes:
+                return diskStats
+        return None
+
+###############################################################################
+class IdentifierCache(object):
+
+    #-------------------------------------------------------------------------------
+    def __init__(self, data=""):
+        self._byUUID = load_json(data)
+        self._byVolumeName = dict()
+        for diskStats in self._byUUID.values():
+            self._byVolumeName[diskStats['name']] = diskStats
+        self._lock = threading.Lock()
+
+    #-------------------------------------------------------------------------------
+    def lookup(self, uuid, volumeName):
+        with self._lock:
+            return self._byUUID.get(uuid) or self._byVolumeName.get(volumeName)
+
+    #-------------------------------------------------------------------------------
+    def store(self, diskStats):
+        # without a uuid there is nothing stable to key on
+        if diskStats.get('uuid'):
+            record = dict((key, diskStats[key]) for key in ('uuid','name','type','identifier'))
+            with self._lock:
+                self._byUUID[record['uuid']] = record
+                self._byVolumeName[record['name']] = record
+
+    #-------------------------------------------------------------------------------
+    def dumps(self):
+        with self._lock:
+            return json.dumps(self._byUUID)
+
+###############################################################################
+class UsageRing(object):
+    __slots__ = ('times', 'values', 'head', 'count')
+
+    #-------------------------------------------------------------------------------
+    def __init__(self, capacity):
+        self.times  = array.array('l', [0]) * capacity
+        self.values = array.array('l', [0]) * capacity
+        self.head   = 0
+        self.count  = 0
+
+    #-------------------------------------------------------------------------------
+    def append(self, t, value):
+        # returns the sample pushed out once the ring is full
+        evicted = None
+        if self.count == len(self.times):
+            evicted = (self.times[self.head], self.values[self.head])
+        else:
+            self.count += 1
+        self.times[self.head]  = t
+        self.values[self.head] = value
+        self.head = (self.head + 1) % len(self.times)
+        return evicted
+
+    #-------------------------------------------------------------------------------
+    def __iter__(self):
+        size = len(self.times)
+        for i in xrange(self.head - self.count, self.head):
+            yield self.times[i % size], self.values[i % size]
+
+    #-------------------------------------------------------------------------------
+    def __len__(self):
+        return self.count
+
+    #-------------------------------------------------------------------------------
+    @property
+    def capacity(self):
+        return len(self.times)
+
+    #-------------------------------------------------------------------------------
+    @property
+    def span(self):
+        if not self.count:
+            return 0
+        return self.times[self.head - 1] - self.times[(self.head - self.count) % len(self.times)]
+
+    #-------------------------------------------------------------------------------
+    def dumps(self):
+        times, values = array.array('l'), array.array('l')
+        for t, value in self:
+            times.append(t)
+            values.append(value)
+        return (times.tostring(), values.tostring())
+
+    #-------------------------------------------------------------------------------
+    def load(self, timesData, valuesData):
+        times, values = array.array('l'), array.array('l')
+        times.fromstring(timesData)
+        values.fromstring(valuesData)
+        for t, value in itertools.izip(times, values):
+            self.append(t, value)
+
+###############################################################################
+class UsageHistory(object):
+
+    #-------------------------------------------------------------------------------
+    def __init__(self, fineSize):
+        self.fine       = UsageRing(fineSize)
+        self.hourly     = UsageRing(k_historyHours)
+        self._hour      = 0
+        self._hourSum   = 0
+        self._hourCount = 0
+        self._rebase()
+
+    #-------------------------------------------------------------------------------
+    def _rebase(self):
+        # regression sums are kept relative to the oldest sample so they stay small,
+        # and rebuilt once per ring length so rounding error can't accumulate
+        self._t0 = self._v0 = None
+        self._n = 0
+        self._st = self._sv = self._stt = self._stv = 0.0
+        self._adds = 0
+        for t, value in self.fine:
+            self._accumulate(t, value, 1)
+
+    #-------------------------------------------------------------------------------
+    def _accumulate(self, t, value, sign):
+        if self._t0 is None:
+            self._t0, self._v0 = t, value
+        x = float(t - self._t0)
+        y = float(value - self._v0)
+        self._n   += sign
+        self._st  += sign * x
+        self._sv  += sign * y
+        self._stt += sign * x * x
+        self._stv += sign * x * y
+
+    #-------------------------------------------------------------------------------
+    def add(self, t, megsUsed):
+        # returns True when an hourly average was closed off
+        t = int(t)
+        evicted = self.fine.append(t, megsUsed)
+        self._accumulate(t, megsUsed, 1)
+        if evicted:
+            self._accumulate(evicted[0], evicted[1], -1)
+        self._adds += 1
+        if self._adds >= self.fine.capacity:
+            self._rebase()
+
+        closed = False
+        hour = t // k_historyHourSecs
+        if self._hourCount and hour != self._hour:
+            self.hourly.append(self._hour * k_historyHourSecs, self._hourSum // self._hourCount)
+            self._hourSum = self._hourCount = 0
+            closed = True
+        self._hour = hour
+        self._hourSum += megsUsed
+        self._hourCount += 1
+        return closed
+
+    #-------------------------------------------------------------------------------
+    def fillRate(self):
+        # least squares slope in MB/hour, None until there is enough history to trust
+        if self._n < k_historyMinSamples or self.fine.span < k_historyMinSpan:
+            return None
+        denominator = self._n * self._stt - self._st * self._st
+        if denominator <= 0:
+            return None
+        return (self._n * self._stv - self._st * self._sv) / denominator * k_historyHourSecs
+
+    #-------------------------------------------------------------------------------
+    def dumps(self):
+        return marshal.dumps((k_historyVersion, array.array('l').itemsize,
+            self._hour, self._hourSum, self._hourCount, self.fine.dumps(), self.hourly.dumps()))
+
+    #-------------------------------------------------------------------------------
+    @classmethod
+    def loads(cls, data, fineSize):
+        # samples are replayed into rings of the current size, so a changed poll interval just trims
+        history = cls(fineSize)
+        try:
+            version, itemSize, hour, hourSum, hourCount, fine, hourly = marshal.loads(data)
+        except (EOFError, ValueError, TypeError):
+            return history
+        if version != k_historyVersion or itemSize != array.array('l').itemsize:
+            return history
+        history.fine.load(*fine)
+        history.hourly.load(*hourly)
+        history._hour, history._hourSum, history._hourCount = hour, hourSum, hourCount
+        history._rebase()
+        return history
+
+###############################################################################
+class DirectoryScanner(object):
+
+    #-------------------------------------------------------------------------------
+    def __init__(self, root, data, cancel):
+        self.root       = root
+        self.cancel     = cancel
+        self.listed     = 0
+        self.totals     = dict()
+        # path -> [mtime, bytes in files directly inside, subdirectory names]
+        self._cache     = data.get('cache', {})
+        self._built     = data.get('built', 0)
+        if time.time() - self._built > k_scanCacheMaxAge:
+            # files can grow without touching their directory's mtime, so the cache is rebuilt now and then
+            self._cache = dict()
+            self._built = time.time()
+        self._newCache  = dict()
+        self._entries   = 0
+        self._start     = 0
+
+    #-------------------------------------------------------------------------------
+    def scan(self):
+        # returns False if cancelled
+        self._start = time.time()
+        try:
+            rootDevice = os.lstat(self.root).st_dev
+        except OSError:
+            return False
+        order = list()
+        stack = [self.root]
+        while stack:
+            if self.cancel.is_set():
+                return False
+            path = stack.pop()
+            try:
+                stats = os.lstat(path)
+            except OSError:
+                continue
+            if stats.st_dev != rootDevice:
+                continue
+            cached = self._cache.get(path)
+            if cached and cached[0] == stats.st_mtime:
+                entry = cached
+            else:
+                entry = [stats.st_mtime] + list(self.listDirectory(path))
+                self.listed += 1
+            self._newCache[path] = entry
+            order.append(path)
+            stack.extend(os.path.join(path, name) for name in entry[2])
+            self.throttle()
+
+        # children were visited after their parents, so walking backwards sums each subtree once
+        for path in reversed(order):
+            mtime, size, subdirs = self._newCache[path]
+            self.totals[path] = size + sum(self.totals.get(os.path.join(path, name), 0) for name in subdirs)
+        return True
+
+    #-------------------------------------------------------------------------------
+    def listDirectory(self, path):
+        size = 0
+        subdirs = list()
+        try:
+            if scandir:
+                for entry in scandir(path):
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.name)
+                    else:
+                        size += disk_bytes(entry.stat(follow_symlinks=False))
+                    self.throttle()
+            else:
+                for name in os.listdir(path):
+                    stats = os.lstat(os.path.join(path, name))
+                    if stat.S_ISDIR(stats.st_mode):
+                        subdirs.append(name)
+                    else:
+                        size += disk_bytes(stats)
+                    self.throttle()
+        except OSError:
+            pass
+        return size, subdirs
+
+    #-------------------------------------------------------------------------------
+    def throttle(self):
+        # sleep whenever the scan gets ahead of the allowed entry rate
+        self._entries += 1
+        if self._entries % k_scanBatch == 0:
+            ahead = self._start + float(self._entries) / k_scanRate - time.time()
+            if ahead > 0:
+                self.cancel.wait(ahead)
+
+    #-------------------------------------------------------------------------------
+    def top(self, count):
+        # largest directories below the mount point as (path, megs)
+        paths = heapq.nlargest(count, (path for path in self.totals if path != self.root), key=self.totals.get)
+        return [(path, self.totals[path] // k_bytesPerMeg) for path in paths]
+
+    #-------------------------------------------------------------------------------
+    def dumps(self):
+        return json.dumps({'built':self._built, 'cache':self._newCache})
+
+###############################################################################
+class TriggerIndex(object):
+
+    #-------------------------------------------------------------------------------
+    def __init__(self):
+        # (devId, key, rising) -> parallel sorted lists of levels and trigger ids,
+        # one set for the level a trigger fires at and one for where it re-arms
+        self._fire      = dict()
+        self._rearm     = dict()
+        self._triggers  = dict()
+        self._armed     = dict()
+        self._keys      = collections.defaultdict(collections.Counter)
+        self._last      = dict()
+        self._seeds     = dict()
+        self._lock      = threading.RLock()
+
+    #-------------------------------------------------------------------------------
+    def add(self, trigId, devId, key, rising, level, hysteresis):
+        rearm = level - hysteresis if rising else level + hysteresis
+        with self._lock:
+            self.remove(trigId)
+            self._triggers[trigId] = (devId, key, rising, level, rearm)
+            self._insert(self._fire, (devId, key, rising), level, trigId)
+            self._insert(self._rearm, (devId, key, rising), rearm, trigId)
+            self._keys[devId][key] += 1
+            # a value already past the threshold has to recover before the trigger can fire
+            last = self._last.get((devId, key), self._seeds.get(devId, {}).get(key))
+            self._armed[trigId] = last is None or not (last > level if rising else last < level)
+
+    #-------------------------------------------------------------------------------
+    def remove(self, trigId):
+        with self._lock:
+            if trigId not in self._triggers:
+                return
+            devId, key, rising, level, rearm = self._triggers.pop(trigId)
+            self._delete(self._fire, (devId, key, rising), level, trigId)
+            self._delete(self._rearm, (devId, key, rising), rearm, trigId)
+            self._keys[devId][key] -= 1
+            if not self._keys[devId][key]:
+                del self._keys[devId][key]
+            del self._armed[trigId]
+
+    #-------------------------------------------------------------------------------
+    def seed(self, devId, states):
+        # states from before a restart stand in for the previous values until the device's
+        # first check, so a volume mounted or unmounted meanwhile still fires
+        with self._lock:
+            self._seeds[devId] = dict(states)
+
+    #-------------------------------------------------------------------------------
+    def check(self, devId, states):
+        # only triggers whose level lies between the previous and current value are touched
+        fired = list()
+        with self._lock:
+            seed = self._seeds.pop(devId, {})
+            for key in self._keys.get(devId, ()):
+                new = states[key]
+                old = self._last.get((devId, key), seed.get(key))
+                self._last[(devId, key)] = new
+                if old is None or new == old:
+                    continue
+                rising = new > old
+
+                levels, trigIds = self._fire.get((devId, key, rising), ((), ()))
+                if rising:
+                    crossed = trigIds[bisect.bisect_left(levels, old):bisect.bisect_left(levels, new)]
+                else:
+                    crossed = trigIds[bisect.bisect_right(levels, new):bisect.bisect_right(levels, old)]
+                for trigId in crossed:
+                    if self._armed[trigId]:
+                        self._armed[trigId] = False
+                        fired.append(trigId)
+
+                levels, trigIds = self._rearm.get((devId, key, not rising), ((), ()))
+                if rising:
+                    crossed = trigIds[bisect.bisect_right(levels, old):bisect.bisect_right(levels, new)]
+                else:
+                    crossed = trigIds[bisect.bisect_left(levels, new):bisect.bisect_left(levels, old)]
+                for trigId in crossed:
+                    self._armed[trigId] = True
+        return fired
+
+    #-------------------------------------------------------------------------------
+    @staticmethod
+    def _insert(index, indexKey, level, trigId):
+        levels, trigIds = index.setdefault(indexKey, ([], []))
+        i = bisect.bisect_right(levels, level)
+        levels.insert(i, level)
+        trigIds.insert(i, trigId)
+
+    #-------------------------------------------------------------------------------
+    @staticmethod
+    def _delete(index, indexKey, level, trigId):
+        levels, trigIds = index[indexKey]
+        i = bisect.bisect_left(levels, level)
+        i = trigIds.index(trigId, i)
+        del levels[i]
+        del trigIds[i]
+        if not levels:
+            del index[indexKey]
+
+###############################################################################
+class PhaseStats(object):
+
+    #-------------------------------------------------------------------------------
+    def __init__(self, size=k_statsSamples):
+        self.size       = size
+        self._samples   = dict()
+        self._counts    = collections.Counter()
+        self._lock      = threading.Lock()
+
+    #-------------------------------------------------------------------------------
+    def add(self, phase, seconds):
+        with self._lock:
+            if phase not in self._samples:
+                self._samples[phase] = collections.deque(maxlen=self.size)
+            self._samples[phase].append(seconds)
+            self._counts[phase] += 1
+
+    #-------------------------------------------------------------------------------
+    def timer(self, phase):
+        return PhaseTimer(self, phase)
+
+    #-------------------------------------------------------------------------------
+    def count(self, phase):
+        return self._counts[phase]
+
+    #-------------------------------------------------------------------------------
+    def summary(self, phase):
+        # (total count, min, avg, p95) in milliseconds over the buffered samples
+        with self._lock:
+            samples = sorted(self._samples.get(phase, []))
+        if not samples:
+            return None
+        p95 = samples[min(len(samples)-1, int(len(samples)*0.95))]
+        return (self._counts[phase], samples[0]*1000, sum(samples)/len(samples)*1000, p95*1000)
+
+###############################################################################
+class PhaseTimer(object):
+
+    #-------------------------------------------------------------------------------
+    def __init__(self, stats, phase):
+        self.stats  = stats
+        self.phase  = phase
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stats.add(self.phase, time.time() - self.start)
+        return False
+
+###############################################################################
+class ReachabilityProbe(object):
+
+    #-------------------------------------------------------------------------------
+    def __init__(self, timeout=k_probeTimeout, cacheSecs=k_probeCacheSecs):
+        self.timeout    = timeout
+        self.cacheSecs  = cacheSecs
+        self._cache     = dict()
+        self._addresses = dict()
+        self._lock      = threading.Lock()
+
+    #-------------------------------------------------------------------------------
+    def reachable(self, host, ports):
+        key = (host, tuple(ports))
+        with self._lock:
+            checked, result = self._cache.get(key, (0, False))
+        if time.time() < checked + self.cacheSecs:
+            return result
+        addresses = self.resolve(host)
+        result = bool(addresses) and tcp_probe(addresses, ports, self.timeout)
+        with self._lock:
+            self._cache[key] = (time.time(), result)
+        return result
+
+    #-------------------------------------------------------------------------------
+    def resolve(self, host):
+        # getaddrinfo has no timeout and mDNS for an offline .local server can take seconds,
+        # so lookups run on their own thread; a late answer is still kept for the next probe
+        with self._lock:
+            resolved, addresses, lookup = self._addresses.get(host, (0, [], None))
+        if lookup and lookup.is_alive():
+            return []
+        if addresses and time.time() < resolved + k_resolveCacheSecs:
+            return addresses
+        addresses = list()
+        lookup = threading.Thread(target=resolve_addresses, args=(host, addresses), name='ReachabilityProbe')
+        lookup.daemon = True
+        lookup.start()
+        lookup.join(k_resolveTimeout)
+        with self._lock:
+            self._addresses[host] = (time.time(), addresses, lookup)
+        return [] if lookup.is_alive() else addresses
+
+###############################################################################
+class MountTableWatcher(object):
+
+    #-------------------------------------------------------------------------------
+    def __init__(self, source=None):
+        if source is None:
+            if os.path.exists(k_mountInfoFile):
+                source = mountinfo_fingerprint
+            else:
+                source = volumes_fingerprint
+        self.source         = source
+        self._fingerprint   = None
+
+    #-------------------------------------------------------------------------------
+    def changed(self):
+        fingerprint = self.source()
+        if fingerprint != self._fingerprint:
+            self._fingerprint = fingerprint
+            return True
+        return False
+
+###############################################################################
+class DeviceScheduler(object):
+
+    #-------------------------------------------------------------------------------
+    def __init__(self):
+        self.wake       = threading.Event()
+        self._heap      = list()
+        self._current   = dict()
+        self._counter   = itertools.count()
+        self._lock      = threading.Lock()
+
+    #-------------------------------------------------------------------------------
+    def schedule(self, devId, task, due):
+        # rescheduling supersedes the old entry, which is discarded lazily when popped
+        with self._lock:
+            seq = next(self._counter)
+            self._current[(devId, task)] = seq
+            heapq.heappush(self._heap, (due, seq, devId, task))
+        self.wake.set()
+
+    #-------------------------------------------------------------------------------
+    def remove(self, devId):
+        with self._lock:
+            for key in [key for key in self._current if key[0] == devId]:
+                del self._current[key]
+
+    #-------------------------------------------------------------------------------
+    def popDue(self, now):
+        due = list()
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                when, seq, devId, task = heapq.heappop(self._heap)
+                if self._current.get((devId, task)) == seq:
+                    del self._current[(devId, task)]
+                    due.append((devId, task))
+        return due
+
+    #-------------------------------------------------------------------------------
+    def nextDue(self):
+        with self._lock:
+            while self._heap:
+                when, seq, devId, task = self._heap[0]
+                if self._current.get((devId, task)) == seq:
+                    return when
+                heapq.heappop(self._heap)
+        return None
+
+###############################################################################
+class CommandExecutor(object):
+
+    #-------------------------------------------------------------------------------
+    def __init__(self, logger, workers=k_executorWorkers, timeout=k_commandTimeout):
+        self.logger     = logger
+        self.timeout    = timeout
+
+        self._queue     = Queue.Queue()
+        self._inFlight  = set()
+        self._lock      = threading.Lock()
+        self._threads   = list()
+        for i in range(workers):
+            thread = threading.Thread(target=self._worker, name='CommandExecutor-{0}'.format(i))
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    #-------------------------------------------------------------------------------
+    def submit(self, key, cmd, callback=None, timeout=None, started=None):
+        # refuse rather than queue behind a command that may be wedged
+        with self._lock:
+            if key in self._inFlight:
+                return False
+            self._inFlight.add(key)
+        self._queue.put((key, cmd, callback, timeout or self.timeout, started))
+        return True
+
+    #-------------------------------------------------------------------------------
+    def busy(self, key):
+        with self._lock:
+            return key in self._inFlight
+
+    #-------------------------------------------------------------------------------
+    def stop(self, wait=k_executorStopWait):
+        for thread in self._threads:
+            self._queue.put(None)
+        # give idle workers a moment to exit, but don't hang on a wedged command
+        deadline = time.time() + wait
+        for thread in self._threads:
+            thread.join(max(0, deadline - time.time()))
+
+    #-------------------------------------------------------------------------------
+    def _worker(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                break
+            key, cmd, callback, timeout, started = job
+            try:
+                if started:
+                    started()
+                if callable(cmd):
+                    success, response = cmd()
+                else:
+                    success, response = do_shell_script(cmd, timeout)
+                if callback:
+                    callback(success, response)
+            except Exception:
+                self.logger.exception('command failed: {0}'.format(cmd))
+            finally:
+                with self._lock:
+                    self._inFlight.discard(key)
+
+###############################################################################
+class MetricsServer(object):
+
+    #-------------------------------------------------------------------------------
+    def __init__(self, logger, port=k_metricsPort):
+        self.logger     = logger
+        self.port       = port
+        self.buffers    = dict()
+        self._httpd     = None
+
+    #-------------------------------------------------------------------------------
+    def start(self):
+        try:
+            self._httpd = MetricsHTTPServer((k_metricsHost, self.port), MetricsRequestHandler)
+        except socket.error as e:
+            self.logger.error('unable to serve metrics on port {0}: {1}'.format(self.port, e))
+            return False
+        self._httpd.metrics = self
+        thread = threading.Thread(target=self._httpd.serve_forever, name='MetricsServer')
+        thread.daemon = True
+        thread.start()
+        self.logger.info('serving metrics at http://{0}:{1}/metrics'.format(k_metricsHost, self.port))
+        return True
+
+    #-------------------------------------------------------------------------------
+    def stop(self):
+        if self._httpd:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+            self._httpd = None
+
+    #-------------------------------------------------------------------------------
+    def publish(self, diskDevs):
+        # rendered once per cycle from in-memory states; requests only hand out the latest buffers
+        devices = list()
+        for diskDev in diskDevs:
+            devices.append((diskDev.dev.id, diskDev.name, diskDev.dev.deviceTypeId, diskDev.props['volumeName'], diskDev.snapshot()))
+
+        lines = list()
+        for metric, key, description in k_metricStates:
+            lines.append('# HELP macdisks_{0} {1}'.format(metric, description))
+            lines.append('# TYPE macdisks_{0} gauge'.format(metric))
+            for devId, name, typeId, volumeName, states in devices:
+                value = states.get(key)
+                if isinstance(value, (bool, int, long, float)):
+                    lines.append(u'macdisks_{0}{{device="{1}",volume="{2}",type="{3}"}} {4}'.format(
+                                    metric, prometheus_escape(name), prometheus_escape(volumeName), typeId, float(value)))
+        prometheus = u'\n'.join(lines) + u'\n'
+
+        snapshot = dict()
+        for devId, name, typeId, volumeName, states in devices:
+            snapshot[str(devId)] = {'name':name, 'type':typeId, 'volume':volumeName, 'states':states}
+        data = json.dumps({'generated':time.time(), 'devices':snapshot}, default=unicode)
+
+        self.buffers = {'/metrics'      : (k_prometheusType, prometheus.encode('utf-8')),
+                        '/metrics.json' : (k_jsonType, data),
+                        }
+
+###############################################################################
+class MetricsHTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads      = True
+    allow_reuse_address = True
+
+###############################################################################
+class MetricsRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    #-------------------------------------------------------------------------------
+    def do_GET(self):
+        buffer = self.server.metrics.buffers.get(self.path.split('?')[0])
+        if buffer is None:
+            self.send_error(404)
+            return
+        contentType, body = buffer
+        self.send_response(200)
+        self.send_header('Content-Type', contentType)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    #-------------------------------------------------------------------------------
+    def log_message(self, format, *args):
+        pass    # scrapes would otherwise fill the plugin log
+
+###############################################################################
+class DarwinStatfs(ctypes.Structure):
+    # struct statfs with 64 bit inodes, as returned by getmntinfo
+    _fields_ = [('f_bsize',         ctypes.c_uint32),
+                ('f_iosize',        ctypes.c_int32),
+                ('f_blocks',        ctypes.c_uint64),
+                ('f_bfree',         ctypes.c_uint64),
+                ('f_bavail',        ctypes.c_uint64),
+                ('f_files',         ctypes.c_uint64),
+                ('f_ffree',         ctypes.c_uint64),
+                ('f_fsid',          ctypes.c_int32 * 2),
+                ('f_owner',         ctypes.c_uint32),
+                ('f_type',          ctypes.c_uint32),
+                ('f_flags',         ctypes.c_uint32),
+                ('f_fssubtype',     ctypes.c_uint32),
+                ('f_fstypename',    ctypes.c_char * 16),
+                ('f_mntonname',     ctypes.c_char * 1024),
+                ('f_mntfromname',   ctypes.c_char * 1024),
+                ('f_flags_ext',     ctypes.c_uint32),
+                ('f_reserved',      ctypes.c_uint32 * 7),
+                ]
+
 ###############################################################################
 # Utilities
 ###############################################################################
-def do_shell_script (cmd):
-    p = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-    out, err = p.communicate()
+def do_shell_script (cmd, timeout=k_commandTimeout):
+    # run in a new session so a timeout can kill the shell and all its children
+    p = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, preexec_fn=os.setsid)
+    timedOut = list()
+    timer = None
+    if timeout:
+        timer = threading.Timer(timeout, kill_process_group, (p, timedOut))
+        timer.daemon = True
+        timer.start()
+    try:
+        out, err = p.communicate()
+    finally:
+        if timer:
+            timer.cancel()
+    if timedOut:
+        return False, "timed out after {0} seconds: {1}".format(timeout, cmd)
     return (not bool(p.returncode)), out.rstrip()
 
+#-------------------------------------------------------------------------------
+def kill_process_group (p, timedOut):
+    timedOut.append(True)
+    try:
+        os.killpg(p.pid, signal.SIGKILL)
+    except OSError:
+        pass
+
+#-------------------------------------------------------------------------------
+def touch_file (path, result, recentSecs=0):
+    # a small write and fsync forces real I/O; the elapsed time shows whether the disk had to spin up.
+    # a file written within recentSecs by another writer means the disk is awake, reported as None
+    start = time.time()
+    try:
+        if recentSecs and start - os.stat(path).st_mtime < recentSecs:
+            result.append((True, None))
+            return
+    except OSError:
+        pass
+    try:
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0644)
+        try:
+            os.write(fd, time.strftime('%Y-%m-%d %T\n'))
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        result.append((True, time.time() - start))
+    except (IOError, OSError) as e:
+        result.append((False, str(e)))
+
+#-------------------------------------------------------------------------------
+def resolve_addresses (host, addresses):
+    try:
+        for family, socktype, proto, name, address in socket.getaddrinfo(host, None, 0, socket.SOCK_STREAM):
+            addresses.append((family, socktype, proto, address))
+    except (socket.error, socket.gaierror):
+        pass
+
+#-------------------------------------------------------------------------------
+def tcp_probe (addresses, ports, timeout=k_probeTimeout):
+    # non-blocking connects to every address and port at once; true if any completes in time
+    pending = dict()
+    try:
+        for port in ports:
+            for family, socktype, proto, address in addresses:
+                sock = socket.socket(family, socktype, proto)
+                sock.setblocking(0)
+                if sock.connect_ex((address[0], port) + tuple(address[2:])) in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+                    pending[sock.fileno()] = sock
+                else:
+                    sock.close()
+        deadline = time.time() + timeout
+        while pending:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            readable, writable, failed = select.select([], pending.keys(), [], remaining)
+            for fileno in writable:
+                sock = pending.pop(fileno)
+                connected = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR) == 0
+                sock.close()
+                if connected:
+                    return True
+        return False
+    except (socket.error, socket.gaierror):
+        return False
+    finally:
+        for sock in pending.values():
+            sock.close()
+
+#-------------------------------------------------------------------------------
+def volumes_fingerprint (path=k_volumesDir):
+    # only stat the directory itself; stat'ing mount points could hang on a dead server
+    try:
+        return os.stat(path).st_mtime, tuple(sorted(os.listdir(path)))
+    except OSError:
+        return None
+
+#-------------------------------------------------------------------------------
+def mountinfo_fingerprint (path=k_mountInfoFile):
+    try:
+        with open(path, 'rb') as mountInfo:
+            return hashlib.md5(mountInfo.read()).hexdigest()
+    except (IOError, OSError):
+        return None
+
+#-------------------------------------------------------------------------------
+def mount_table ():
+    # read without forking mount
+    if os.path.exists(k_mountInfoFile):
+        return MountTable(mountinfo_mounts())
+    try:
+        return MountTable(darwin_mounts())
+    except (AttributeError, OSError, TypeError):
+        return MountTable()
+
+#-------------------------------------------------------------------------------
+def mountinfo_mounts (path=k_mountInfoFile):
+    mounts = list()
+    try:
+        with open(path) as mountInfo:
+            for line in mountInfo:
+                fields, _, extra = line.partition(' - ')
+                fields, extra = fields.split(), extra.split()
+                if len(fields) >= 6 and len(extra) >= 2:
+                    mountPoint = re.sub(r'\\([0-7]{3})', lambda match: chr(int(match.group(1), 8)), fields[4])
+                    mounts.append((extra[1], mountPoint.decode('utf-8', 'replace'), extra[0], 'ro' in fields[5].split(',')))
+    except (IOError, OSError):
+        pass
+    return mounts
+
+#-------------------------------------------------------------------------------
+def darwin_mounts ():
+    # one getmntinfo call returns every mount; MNT_NOWAIT keeps it from blocking on a dead server
+    libc = ctypes.CDLL(ctypes.util.find_library('c'))
+    getmntinfo = getattr(libc, 'getmntinfo$INODE64', None) or libc.getmntinfo
+    getmntinfo.argtypes = [ctypes.POINTER(ctypes.POINTER(DarwinStatfs)), ctypes.c_int]
+    getmntinfo.restype = ctypes.c_int
+    buffer = ctypes.POINTER(DarwinStatfs)()
+    mounts = list()
+    for i in range(getmntinfo(ctypes.byref(buffer), k_darwinNoWait)):
+        mounts.append((buffer[i].f_mntfromname.decode('utf-8', 'replace'),
+                       buffer[i].f_mntonname.decode('utf-8', 'replace'),
+                       buffer[i].f_fstypename.decode('utf-8', 'replace'),
+                       bool(buffer[i].f_flags & k_statvfsReadOnly)))
+    return mounts
+
+#-------------------------------------------------------------------------------
+def prometheus_escape (value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+#-------------------------------------------------------------------------------
+def load_json (data):
+    try:
+        return json.loads(data) if data else dict()
+    except ValueError:
+        return dict()
+
+#-------------------------------------------------------------------------------
+def read_file (path):
+    try:
+        with open(path) as dataFile:
+            return dataFile.read()
+    except (IOError, OSError):
+        return ""
+
+#-------------------------------------------------------------------------------
+def disk_bytes (stats):
+    # allocated size like du reports, falling back to apparent size where blocks aren't available
+    blocks = getattr(stats, 'st_blocks', None)
+    return blocks * 512 if blocks is not None else stats.st_size
+
+#-------------------------------------------------------------------------------
+def is_mounted (mountPoint):
+    return os.path.ismount(mountPoint)
+
+#-------------------------------------------------------------------------------
+def device_is_mounted_at (devicePath, mountPoint):
+    # a mounted filesystem reports the device number of the node it was mounted from
+    try:
+        return is_mounted(mountPoint) and os.stat(devicePath).st_rdev == os.stat(mountPoint).st_dev
+    except OSError:
+        return False
+
+#-------------------------------------------------------------------------------
+def statvfs_info (mountPoint):
+    # same arithmetic as df: used excludes reserved blocks, values round up
+    try:
+        if not is_mounted(mountPoint):
+            return None
+        st = os.statvfs(mountPoint)
+    except OSError:
+        return None
+    usedBlocks = st.f_blocks - st.f_bfree
+    availBlocks = usedBlocks + st.f_bavail
+    usedInodes = st.f_files - st.f_ffree
+    return {'identifier' : "",
+            'size'       : int(-(-st.f_blocks * st.f_frsize // k_bytesPerMeg)),
+            'used'       : int(-(-usedBlocks   * st.f_frsize // k_bytesPerMeg)),
+            'free'       : int(-(-st.f_bavail  * st.f_frsize // k_bytesPerMeg)),
+            'percent'    : int(-(-100 * usedBlocks // availBlocks)) if availBlocks else 100,
+            'inodes_total'   : int(st.f_files),
+            'inodes_free'    : int(st.f_ffree),
+            'inodes_percent' : int(-(-100 * usedInodes // st.f_files)) if st.f_files else 0,
+            'read_only'      : bool(st.f_flag & k_statvfsReadOnly),
+            'fs_type'        : "",
+            'mountpoint' : mountPoint,
+            }
+
 #-------------------------------------------------------------------------------
 def regextract (source, rule, keys):
+    match = rule.match(source)
+    if not match:
+        return None
     results = dict()
-    for key, value in zip(keys,rule.match(source).groups()):
-        results[key] = value.strip()
+    for key, value in zip(keys,match.groups()):
+        results[key] = value.strip() if value is not None else None
     return results
 
 #-------------------------------------------------------------------------------
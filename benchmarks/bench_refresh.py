@@ -0,0 +1,436 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+###############################################################################
+# Benchmark and replay harness for the Mac Disks plugin.
+#
+# Runs plugin.py against a fake "indigo" module with the shell replaced by a
+# replay backend, so it works on any machine with Python 2.7 and no macOS
+# tools.  Volumes come either from the recorded fixtures or from synthetic
+# generators.
+#
+#   python2.7 benchmarks/bench_refresh.py
+#   python2.7 benchmarks/bench_refresh.py --sizes 10,100 --cycles 50 --capacity df
+#   python2.7 benchmarks/bench_refresh.py --fixtures
+#   python2.7 benchmarks/bench_refresh.py --scheduled 300 --poll-freqs 1,5,10,60
+
+import os
+import sys
+import time
+import random
+import logging
+import plistlib
+import argparse
+import collections
+
+k_benchDir      = os.path.dirname(os.path.abspath(__file__))
+k_pluginDir     = os.path.join(k_benchDir, os.pardir, 'Mac Disks.indigoPlugin', 'Contents')
+k_serverPlugin  = os.path.join(k_pluginDir, 'Server Plugin')
+k_fixturesDir   = os.path.join(k_benchDir, 'fixtures')
+
+sys.path.insert(0, k_benchDir)
+import fake_indigo
+fake_indigo.install()
+sys.path.insert(0, k_serverPlugin)
+import plugin
+
+k_pluginId      = plistlib.readPlist(os.path.join(k_pluginDir, 'Info.plist'))['CFBundleIdentifier']
+k_pluginVersion = plistlib.readPlist(os.path.join(k_pluginDir, 'Info.plist'))['PluginVersion']
+k_stateIds      = fake_indigo.device_state_ids(os.path.join(k_serverPlugin, 'Devices.xml'))
+
+###############################################################################
+# Replay backends
+###############################################################################
+class ReplayBackend(object):
+
+    # recorded output is static, so mounting and unmounting can't be replayed
+    modelsMounts = False
+
+    #-------------------------------------------------------------------------------
+    def __init__(self, dfText, duText):
+        self._dfText    = dfText
+        self._duText    = duText
+        self.calls      = collections.Counter()
+
+    #-------------------------------------------------------------------------------
+    @property
+    def dfText(self):
+        return self._dfText
+
+    @property
+    def duText(self):
+        return self._duText
+
+    #-------------------------------------------------------------------------------
+    def shell(self, cmd, timeout=None):
+        self.calls[cmd.split()[0]] += 1
+        if cmd == plugin.k_dfGetDataCmd:
+            return True, self.dfText
+        elif cmd == plugin.k_duGetDataCmd:
+            return True, self.duText
+        return self.command(cmd)
+
+    #-------------------------------------------------------------------------------
+    def command(self, cmd):
+        return True, ""
+
+    #-------------------------------------------------------------------------------
+    def fingerprint(self):
+        return None
+
+    #-------------------------------------------------------------------------------
+    def statvfs(self, mountPoint):
+        self.calls['statvfs'] += 1
+        return plugin.DfSnapshot(self.dfText).byMountPoint.get(mountPoint)
+
+    #-------------------------------------------------------------------------------
+    def is_mounted(self, mountPoint):
+        return mountPoint in plugin.DfSnapshot(self.dfText).byMountPoint
+
+    #-------------------------------------------------------------------------------
+    def churn(self):
+        pass
+
+    #-------------------------------------------------------------------------------
+    def volumes(self):
+        volumes = list()
+        for diskStats in plugin.DfSnapshot(self.dfText).byMountPoint.values():
+            if diskStats['mountpoint'].startswith('/Volumes/'):
+                volumes.append({'name'      : os.path.basename(diskStats['mountpoint']),
+                                'identifier': diskStats['identifier'],
+                                'network'   : diskStats['identifier'].startswith('//'),
+                                })
+        return sorted(volumes, key=lambda volume: volume['name'])
+
+###############################################################################
+class SyntheticBackend(ReplayBackend):
+
+    modelsMounts = True
+
+    #-------------------------------------------------------------------------------
+    def __init__(self, count, networkShare=0.25, seed=1):
+        super(SyntheticBackend, self).__init__("", "")
+        self.random     = random.Random(seed)
+        self._volumes   = list()
+        for i in range(count):
+            network = self.random.random() < networkShare
+            size = self.random.choice((238475, 476802, 953541, 1907729, 3815447, 7630885))
+            volume = {'name'        : 'Volume {0:04d}'.format(i),
+                      'network'     : network,
+                      'size'        : size,
+                      'used'        : self.random.randint(0, size),
+                      'uuid'        : '{0:08X}-0000-4000-8000-{1:012X}'.format(i, i),
+                      'mounted'     : True,
+                      }
+            if network:
+                volume['identifier'] = '//indigo@nas{0}.local/share{1:04d}'.format(i % 7, i)
+                volume['url'] = 'smb:' + volume['identifier']
+            else:
+                volume['identifier'] = '/dev/disk{0}s1'.format(i + 2)
+            self._volumes.append(volume)
+        self._dirty = True
+
+    #-------------------------------------------------------------------------------
+    def volumes(self):
+        return self._volumes
+
+    #-------------------------------------------------------------------------------
+    @property
+    def dfText(self):
+        if self._dirty:
+            self._dfText = gen_df(self._volumes)
+            self._duText = gen_diskutil_plist(self._volumes)
+            self._snapshot = plugin.DfSnapshot(self._dfText)
+            self._dirty = False
+        return self._dfText
+
+    @property
+    def duText(self):
+        self.dfText
+        return self._duText
+
+    #-------------------------------------------------------------------------------
+    def statvfs(self, mountPoint):
+        self.calls['statvfs'] += 1
+        self.dfText
+        return self._snapshot.byMountPoint.get(mountPoint)
+
+    #-------------------------------------------------------------------------------
+    def is_mounted(self, mountPoint):
+        self.dfText
+        return mountPoint in self._snapshot.byMountPoint
+
+    #-------------------------------------------------------------------------------
+    def command(self, cmd):
+        for volume in self._volumes:
+            if volume['identifier'] in cmd or volume.get('url','\0') in cmd:
+                if 'umount' in cmd:
+                    volume['mounted'] = False
+                elif 'mount' in cmd or 'open' in cmd:
+                    volume['mounted'] = True
+                self._dirty = True
+                break
+        return True, ""
+
+    #-------------------------------------------------------------------------------
+    def fingerprint(self):
+        return tuple(volume['mounted'] for volume in self._volumes)
+
+    #-------------------------------------------------------------------------------
+    def churn(self):
+        # busy volumes gain or lose a few MB between polls
+        for volume in self._volumes:
+            if self.random.random() < 0.5:
+                volume['used'] = min(volume['size'], max(0, volume['used'] + self.random.randint(-8, 64)))
+        self._dirty = True
+
+###############################################################################
+# Synthetic output generators
+###############################################################################
+def gen_df(volumes):
+    lines = ["Filesystem                              1M-blocks   Used Available Capacity  iused      ifree %iused  Mounted on",
+             "/dev/disk1s1                               476802  23487    170612    13%   488443 4881964437    0%   /"]
+    for volume in volumes:
+        if volume['mounted']:
+            free = volume['size'] - volume['used']
+            percent = -(-100 * volume['used'] // volume['size'])
+            lines.append("{0:<40} {1:>9} {2:>6} {3:>9} {4:>8}% {5:>8} {6:>10} {7:>5}%   /Volumes/{8}".format(
+                volume['identifier'], volume['size'], volume['used'], free, percent, volume['used'], free, percent, volume['name']))
+    # mount output follows df, as from plugin.k_dfGetDataCmd
+    lines.append("/dev/disk1s1 on / (apfs, local, read-only, journaled)")
+    for volume in volumes:
+        if volume['mounted']:
+            lines.append("{0} on /Volumes/{1} ({2}, nodev, nosuid)".format(
+                volume['identifier'], volume['name'], 'smbfs' if volume['network'] else 'hfs, local, journaled'))
+    return "\n".join(lines)
+
+#-------------------------------------------------------------------------------
+def gen_diskutil_plist(volumes):
+    disks = list()
+    for volume in volumes:
+        if volume['network']:
+            continue
+        whole = volume['identifier'][len('/dev/'):].rsplit('s', 1)[0]
+        partition = {'Content'          : 'Apple_HFS',
+                     'DeviceIdentifier' : volume['identifier'][len('/dev/'):],
+                     'Size'             : volume['size'] * 1024 * 1024,
+                     'VolumeName'       : volume['name'],
+                     'VolumeUUID'       : volume['uuid'],
+                     }
+        if volume['mounted']:
+            partition['MountPoint'] = '/Volumes/' + volume['name']
+        disks.append({'Content'         : 'GUID_partition_scheme',
+                      'DeviceIdentifier': whole,
+                      'Size'            : volume['size'] * 1024 * 1024,
+                      'Partitions'      : [partition],
+                      })
+    return plistlib.writePlistToString({'AllDisksAndPartitions': disks})
+
+#-------------------------------------------------------------------------------
+def gen_diskutil_text(volumes):
+    lines = list()
+    for volume in volumes:
+        if volume['network']:
+            continue
+        ident = volume['identifier'][len('/dev/'):]
+        lines.append("/dev/{0} (external, physical):".format(ident.rsplit('s', 1)[0]))
+        lines.append("   #:                       TYPE NAME                    SIZE       IDENTIFIER")
+        lines.append("   1:                  Apple_HFS {0:<23} {1:>5.1f} GB   {2}".format(volume['name'], volume['size'] / 1024., ident))
+    return "\n".join(lines)
+
+###############################################################################
+# Harness
+###############################################################################
+def load_fixtures():
+    with open(os.path.join(k_fixturesDir, 'df_mount.txt')) as dfFile:
+        dfText = dfFile.read()
+    with open(os.path.join(k_fixturesDir, 'diskutil_list.plist')) as duFile:
+        duText = duFile.read()
+    return ReplayBackend(dfText, duText)
+
+#-------------------------------------------------------------------------------
+def make_devices(volumes):
+    devices = list()
+    for devId, volume in enumerate(volumes, 1):
+        props = {'volumeName'   : volume['name'],
+                 'mountPoint'   : '/Volumes/' + volume['name'],
+                 'preventSleep' : False,
+                 'forceUnmount' : False,
+                 }
+        if volume['network']:
+            deviceTypeId = 'networkDisk'
+            props['volumeURL'] = volume.get('url', 'smb:' + volume['identifier'])
+            props['urlScheme'] = 'smbfs'
+        else:
+            deviceTypeId = 'localDisk'
+        devices.append(fake_indigo.Device(devId, volume['name'], deviceTypeId, props, k_stateIds[deviceTypeId], k_pluginVersion))
+    return devices
+
+#-------------------------------------------------------------------------------
+def start_plugin(backend, capacityMethod):
+    plugin.do_shell_script = backend.shell
+    plugin.statvfs_info = backend.statvfs
+    plugin.is_mounted = backend.is_mounted
+    prefs = fake_indigo.Dict({'capacityMethod': capacityMethod})
+    instance = plugin.Plugin(k_pluginId, 'Mac Disks', k_pluginVersion, prefs)
+    instance.startup()
+    instance.mountWatcher = plugin.MountTableWatcher(backend.fingerprint)
+    instance.probe.reachable = lambda host, ports: True
+    return instance
+
+#-------------------------------------------------------------------------------
+def run_cycle(instance, doIdentify=False):
+    instance.refresh_data(doIdentify)
+    for diskDev in instance.deviceDict.values():
+        diskDev.update(doIdentify)
+
+#-------------------------------------------------------------------------------
+def wait_idle(instance, devId, timeout=30):
+    deadline = time.time() + timeout
+    while instance.executor.busy(devId) and time.time() < deadline:
+        time.sleep(0.001)
+
+#-------------------------------------------------------------------------------
+def wait_mounted(instance, diskDev, timeout=30):
+    # stands in for the concurrent thread running the device's 'verify' tasks
+    wait_idle(instance, diskDev.dev.id, timeout)
+    deadline = time.time() + timeout
+    pending = True
+    while pending and time.time() < deadline:
+        instance.refresh_data(diskDevs=[diskDev])
+        diskDev.update()
+        pending = diskDev.verifyMount(time.time())
+
+#-------------------------------------------------------------------------------
+def summarize(samples):
+    samples = sorted(samples)
+    return {'min'   : samples[0] * 1000,
+            'avg'   : sum(samples) / len(samples) * 1000,
+            'p95'   : samples[min(len(samples) - 1, int(len(samples) * 0.95))] * 1000,
+            }
+
+#-------------------------------------------------------------------------------
+def benchmark(label, backend, args):
+    results = collections.OrderedDict()
+    devices = make_devices(backend.volumes())
+
+    start = time.time()
+    instance = start_plugin(backend, args.capacity)
+    for dev in devices:
+        instance.deviceStartComm(dev)
+    run_cycle(instance)
+    results['startup'] = summarize([time.time() - start])
+
+    backend.calls.clear()
+    updatesBefore = sum(dev.serverUpdates for dev in devices)
+    samples = list()
+    for i in range(args.cycles):
+        if args.churn:
+            backend.churn()
+        start = time.time()
+        run_cycle(instance)
+        samples.append(time.time() - start)
+    results['cycle'] = summarize(samples)
+    cycleCalls = dict((key, value / float(args.cycles)) for key, value in backend.calls.items())
+    cycleUpdates = (sum(dev.serverUpdates for dev in devices) - updatesBefore) / float(args.cycles)
+
+    samples = list()
+    start = time.time()
+    run_cycle(instance, True)
+    results['identify'] = summarize([time.time() - start])
+
+    for newState in [(False, True), ()][not backend.modelsMounts]:
+        samples = list()
+        for diskDev in list(instance.deviceDict.values())[:args.mounts]:
+            start = time.time()
+            diskDev.onState = newState
+            wait_mounted(instance, diskDev)
+            samples.append(time.time() - start)
+        if samples:
+            results[['unmount','mount'][newState]] = summarize(samples)
+
+    instance.shutdown()
+
+    print("\n{0}: {1} devices, {2} cycles, capacity={3}".format(label, len(devices), args.cycles, args.capacity))
+    print("  {0:<10} {1:>10} {2:>10} {3:>10}".format('phase', 'min ms', 'avg ms', 'p95 ms'))
+    for phase, stats in results.items():
+        print("  {0:<10} {1:>10.3f} {2:>10.3f} {3:>10.3f}".format(phase, stats['min'], stats['avg'], stats['p95']))
+    print("  per cycle: {0:.1f} server updates, calls {1}".format(cycleUpdates,
+            ', '.join('{0}={1:.2f}'.format(key, value) for key, value in sorted(cycleCalls.items())) or 'none'))
+
+#-------------------------------------------------------------------------------
+def scheduled_benchmark(label, backend, args):
+    # drives the plugin's own scheduler on a virtual clock, so mixed poll intervals
+    # are exercised exactly as runConcurrentThread would see them
+    devices = make_devices(backend.volumes())
+    pollFreqs = [int(freq) for freq in args.poll_freqs.split(',')]
+    for i, dev in enumerate(devices):
+        dev.pluginProps['pollFreq'] = str(pollFreqs[i % len(pollFreqs)])
+
+    instance = start_plugin(backend, args.capacity)
+    for dev in devices:
+        instance.deviceStartComm(dev)
+
+    popTimes = list()
+    popDue = instance.scheduler.popDue
+    def timedPopDue(now):
+        start = time.time()
+        due = popDue(now)
+        popTimes.append(time.time() - start)
+        return due
+    instance.scheduler.popDue = timedPopDue
+
+    now = instance.scheduler.nextDue()
+    end = now + args.scheduled
+    backend.calls.clear()
+    updatesBefore = sum(dev.serverUpdates for dev in devices)
+    samples = list()
+    updated = 0
+    while now is not None and now < end:
+        if args.churn:
+            backend.churn()
+        start = time.time()
+        count = instance.runDueTasks(now)
+        if count:
+            samples.append(time.time() - start)
+            updated += count
+        now = max(now, instance.scheduler.nextDue() or end)
+    instance.shutdown()
+
+    cycles = float(max(len(samples), 1))
+    print("\n{0}: {1} devices, {2} virtual seconds, poll {3} s, capacity={4}".format(
+            label, len(devices), args.scheduled, args.poll_freqs, args.capacity))
+    print("  {0:<10} {1:>10} {2:>10} {3:>10}".format('phase', 'min ms', 'avg ms', 'p95 ms'))
+    for phase, phaseSamples in (('popDue', popTimes), ('cycle', samples)):
+        if phaseSamples:
+            stats = summarize(phaseSamples)
+            print("  {0:<10} {1:>10.3f} {2:>10.3f} {3:>10.3f}".format(phase, stats['min'], stats['avg'], stats['p95']))
+    print("  {0} cycles, {1:.1f} devices and {2:.1f} server updates per cycle".format(
+            len(samples), updated / cycles, (sum(dev.serverUpdates for dev in devices) - updatesBefore) / cycles))
+    print("  per cycle: calls {0}".format(
+            ', '.join('{0}={1:.2f}'.format(key, value / cycles) for key, value in sorted(backend.calls.items())) or 'none'))
+
+#-------------------------------------------------------------------------------
+def main():
+    parser = argparse.ArgumentParser(description="Mac Disks refresh benchmark")
+    parser.add_argument('--sizes',    default='10,100,1000',    help="comma separated synthetic volume counts")
+    parser.add_argument('--cycles',   default=20, type=int,     help="refresh cycles per run")
+    parser.add_argument('--mounts',   default=5, type=int,      help="devices to unmount and remount per run")
+    parser.add_argument('--capacity', default='statvfs',        choices=('df', 'statvfs'))
+    parser.add_argument('--churn',    action='store_true',      help="change usage between cycles")
+    parser.add_argument('--fixtures', action='store_true',      help="replay the recorded fixtures instead")
+    parser.add_argument('--scheduled', default=0, type=int,     help="virtual seconds to run through the scheduler instead of fixed cycles")
+    parser.add_argument('--poll-freqs', default='1,5,10,30,60', help="comma separated poll intervals assigned round robin in --scheduled mode")
+    parser.add_argument('--debug',    action='store_true')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=[logging.WARNING, logging.DEBUG][args.debug])
+
+    run = scheduled_benchmark if args.scheduled else benchmark
+    if args.fixtures:
+        run('fixtures', load_fixtures(), args)
+    else:
+        for count in [int(size) for size in args.sizes.split(',')]:
+            run('synthetic', SyntheticBackend(count), args)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+###############################################################################
+# Minimal stand-in for the "indigo" module so plugin.py can be imported and
+# exercised outside of Indigo Server.  Only what the plugin touches is provided.
+
+import sys
+import logging
+import tempfile
+import threading
+import time
+import xml.etree.ElementTree as ElementTree
+
+###############################################################################
+# constants
+
+class kStateImageSel(object):
+    SensorOff   = 'SensorOff'
+    SensorOn    = 'SensorOn'
+
+class kDimmerRelayAction(object):
+    TurnOn      = 'TurnOn'
+    TurnOff     = 'TurnOff'
+    Toggle      = 'Toggle'
+
+class kUniversalAction(object):
+    RequestStatus   = 'RequestStatus'
+
+class Dict(dict):
+    pass
+
+class List(list):
+    pass
+
+###############################################################################
+class PluginBase(object):
+
+    class StopThread(Exception):
+        pass
+
+    #-------------------------------------------------------------------------------
+    def __init__(self, pluginId, pluginDisplayName, pluginVersion, pluginPrefs):
+        self.pluginId           = pluginId
+        self.pluginDisplayName  = pluginDisplayName
+        self.pluginVersion      = pluginVersion
+        self.pluginPrefs        = pluginPrefs
+        self.logger             = logging.getLogger(pluginId)
+        self.stopThread         = False
+
+    def __del__(self):
+        pass
+
+    #-------------------------------------------------------------------------------
+    def sleep(self, seconds):
+        if self.stopThread:
+            raise self.StopThread
+        time.sleep(max(0, seconds))
+        if self.stopThread:
+            raise self.StopThread
+
+###############################################################################
+class Device(object):
+
+    #-------------------------------------------------------------------------------
+    def __init__(self, devId, name, deviceTypeId, props, stateIds, version):
+        self.id             = devId
+        self.name           = name
+        self.deviceTypeId   = deviceTypeId
+        self.pluginProps    = Dict(props)
+        self.states         = Dict((key, '') for key in stateIds)
+        self.states['onOffState'] = False
+        self.version        = version
+        self.configured     = True
+        self.enabled        = True
+
+        self.serverUpdates  = 0
+        self.statesUpdated  = 0
+        self._lock          = threading.Lock()
+
+    #-------------------------------------------------------------------------------
+    def updateStatesOnServer(self, newStates):
+        with self._lock:
+            self.serverUpdates += 1
+            self.statesUpdated += len(newStates)
+            for item in newStates:
+                self.states[item['key']] = item['value']
+
+    def updateStateOnServer(self, key, value, uiValue=None):
+        self.updateStatesOnServer([{'key':key, 'value':value}])
+
+    def updateStateImageOnServer(self, image):
+        pass
+
+    def stateListOrDisplayStateIdChanged(self):
+        pass
+
+    def replacePluginPropsOnServer(self, props):
+        self.pluginProps = Dict(props)
+
+###############################################################################
+class _Server(object):
+
+    #-------------------------------------------------------------------------------
+    def __init__(self):
+        self._installFolder = tempfile.mkdtemp(prefix='indigo-')
+
+    def getInstallFolderPath(self):
+        return self._installFolder
+
+    def log(self, message, isError=False, type=None):
+        logging.getLogger('indigo').info(message)
+
+class _Trigger(object):
+
+    #-------------------------------------------------------------------------------
+    def __init__(self):
+        self.executed = list()
+
+    def execute(self, trigger):
+        self.executed.append(trigger)
+
+server  = _Server()
+trigger = _Trigger()
+devices = dict()
+
+###############################################################################
+# helpers used by the benchmarks
+###############################################################################
+def device_state_ids(devicesXml):
+    stateIds = dict()
+    for device in ElementTree.parse(devicesXml).getroot().findall('Device'):
+        stateIds[device.get('id')] = [state.get('id') for state in device.findall('States/State')]
+    return stateIds
+
+#-------------------------------------------------------------------------------
+def install():
+    sys.modules['indigo'] = sys.modules[__name__]